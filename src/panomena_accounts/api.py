@@ -0,0 +1,76 @@
+import json
+import hashlib
+from datetime import datetime, date, time
+from decimal import Decimal
+
+from django.db.models import Model
+from django.db.models.fields.files import FieldFile
+from django.utils.datastructures import MultiValueDict
+
+
+def serialize_value(value):
+    """Returns the value in a JSON compatible form that the profile form
+    fields also accept as input.
+
+    """
+    if isinstance(value, Model):
+        return value.pk
+    if isinstance(value, FieldFile):
+        return value.name or None
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def profile_fields(form):
+    """Returns the names of the form fields stored on the user or the
+    profile, the fields exposed through the API.
+
+    """
+    plan = form.field_plan()
+    names = []
+    for route in plan.user + plan.profile:
+        if route.name not in names:
+            names.append(route.name)
+    return names
+
+
+def profile_values(form):
+    """Returns the serialized current values of the exposed fields."""
+    return dict(
+        (name, serialize_value(form.initial.get(name)))
+        for name in profile_fields(form)
+    )
+
+
+def encode(values):
+    """Returns the compact JSON encoding of the values."""
+    return json.dumps(values, separators=(',', ':'), sort_keys=True)
+
+
+def values_etag(values):
+    """Returns the entity tag of the serialized values."""
+    return '"%s"' % hashlib.md5(encode(values)).hexdigest()
+
+
+def merged_data(values, changes):
+    """Returns form data holding the current values updated with the
+    submitted changes.
+
+    """
+    data = MultiValueDict()
+    for name, value in values.items():
+        if value is not None:
+            data[name] = value
+    for name, value in changes.items():
+        if isinstance(value, list):
+            data.setlist(name, value)
+        elif value is None:
+            data.pop(name, None)
+        else:
+            data[name] = value
+    return data
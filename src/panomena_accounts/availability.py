@@ -0,0 +1,84 @@
+import math
+import hashlib
+import threading
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils.encoding import smart_str
+
+
+class BloomFilter(object):
+    """Compact set membership filter without false negatives, used to
+    answer most availability checks without a query.
+
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = int(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(int(self.size / float(capacity) * math.log(2)), 1)
+        self.bits = bytearray(self.size // 8 + 1)
+
+    def positions(self, value):
+        """Returns the bit positions of the value."""
+        digest = hashlib.md5(smart_str(value)).hexdigest()
+        first, second = int(digest[:16], 16), int(digest[16:], 16)
+        for i in range(self.hashes):
+            yield (first + i * second) % self.size
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, value):
+        for position in self.positions(value):
+            if not self.bits[position // 8] & (1 << (position % 8)):
+                return False
+        return True
+
+
+bloom = None
+bloom_lock = threading.Lock()
+
+
+def get_bloom():
+    """Returns the username filter, warming it from the user table on
+    first use. Returns None unless ACCOUNTS_USERNAME_BLOOM is enabled.
+
+    """
+    global bloom
+    if not getattr(settings, 'ACCOUNTS_USERNAME_BLOOM', False):
+        return None
+    if bloom is None:
+        with bloom_lock:
+            if bloom is None:
+                capacity = getattr(settings,
+                    'ACCOUNTS_USERNAME_BLOOM_CAPACITY', 1000000)
+                usernames = User.objects.values_list('username', flat=True)
+                warm = BloomFilter(capacity)
+                for username in usernames.iterator():
+                    warm.add(username)
+                bloom = warm
+    return bloom
+
+
+def user_saved_handler(sender, instance, **kwargs):
+    """Adds saved usernames to the filter once it is warm."""
+    if bloom is not None:
+        bloom.add(instance.username)
+
+
+def username_available(username, user=None, authoritative=True):
+    """Returns whether the username is free for the given user. The
+    filter only answers for non authoritative checks since it misses
+    users created by other processes.
+
+    """
+    if not authoritative:
+        names = get_bloom()
+        if names is not None and username not in names:
+            return True
+    users = User.objects.filter(username=username)
+    if user is not None and user.pk is not None:
+        users = users.exclude(pk=user.pk)
+    return not users.exists()
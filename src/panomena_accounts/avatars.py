@@ -0,0 +1,164 @@
+import os
+import hashlib
+from cStringIO import StringIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.exceptions import ImproperlyConfigured
+
+from panomena_accounts.models import OrphanedFile
+from panomena_accounts.utils import get_profile_model
+from panomena_accounts.executors import get_executor
+from panomena_accounts.instrumentation import phase
+
+
+def avatar_sizes():
+    """Returns the rendition sizes configured in ACCOUNTS_AVATAR_SIZES."""
+    return getattr(settings, 'ACCOUNTS_AVATAR_SIZES', ((64, 64), (128, 128)))
+
+
+def content_hash(upload):
+    """Returns the sha1 of the uploaded content, read chunk by chunk."""
+    digest = hashlib.sha1()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    upload.seek(0)
+    return digest.hexdigest()
+
+
+def image_field():
+    """Returns the image field of the profile model."""
+    return get_profile_model()._meta.get_field('image')
+
+
+def avatar_root():
+    """Returns the storage directory all avatars are kept below, taken
+    from ACCOUNTS_AVATAR_PATH or the fixed leading part of the image
+    field's upload_to.
+
+    """
+    path = getattr(settings, 'ACCOUNTS_AVATAR_PATH', None)
+    if path:
+        return path.strip('/')
+    upload_to = image_field().upload_to
+    parts = []
+    if not callable(upload_to):
+        for part in upload_to.split('/'):
+            # stop at date based directories
+            if '%' in part:
+                break
+            parts.append(part)
+    root = '/'.join(parts).strip('/')
+    if not root:
+        raise ImproperlyConfigured('Set ACCOUNTS_AVATAR_PATH, the upload_to '
+            'of the profile image field has no fixed directory.')
+    return root
+
+
+def avatar_directory(profile, filename):
+    """Returns the directory new avatars of the profile are stored in,
+    ACCOUNTS_AVATAR_PATH or the directory the image field's upload_to
+    gives.
+
+    """
+    path = getattr(settings, 'ACCOUNTS_AVATAR_PATH', None)
+    if path:
+        return path.strip('/')
+    field = profile._meta.get_field('image')
+    return os.path.dirname(field.generate_filename(profile, filename))
+
+
+def avatar_name(directory, digest, extension):
+    """Returns the content addressed storage name of an avatar."""
+    return os.path.join(directory, digest[:2], digest + extension.lower())
+
+
+def rendition_name(name, size):
+    """Returns the storage name of a rendition of the stored avatar."""
+    path, extension = os.path.splitext(name)
+    return '%s_%dx%d%s' % (path, size[0], size[1], extension)
+
+
+def store_avatar(storage, upload, directory):
+    """Stores the upload in the directory under its content hash and
+    returns the storage name. Identical images are stored once. Storage
+    backends stream the upload in chunks so memory use does not grow
+    with the file size.
+
+    """
+    extension = os.path.splitext(upload.name)[1]
+    name = avatar_name(directory, content_hash(upload), extension)
+    if not storage.exists(name):
+        name = storage.save(name, upload)
+    return name
+
+
+def load_image_module():
+    """Imports PIL on first use, returning None if it is missing."""
+    try:
+        from PIL import Image
+    except ImportError:
+        try:
+            import Image
+        except ImportError:
+            Image = None
+    return Image
+
+
+def render_renditions(storage, name):
+    """Renders the fixed size renditions of the stored avatar."""
+    Image = load_image_module()
+    if Image is None:
+        return
+    for size in avatar_sizes():
+        target = rendition_name(name, size)
+        if storage.exists(target):
+            continue
+        source = storage.open(name)
+        try:
+            image = Image.open(source)
+            image.thumbnail(size, Image.ANTIALIAS)
+            output = StringIO()
+            image.save(output, image.format or 'PNG')
+        finally:
+            source.close()
+        storage.save(target, ContentFile(output.getvalue()))
+
+
+def record_orphan(name):
+    """Records the stored file for deferred deletion."""
+    if name:
+        OrphanedFile.objects.get_or_create(name=name)
+
+
+def save_avatar(profile, upload):
+    """Stores the upload as the avatar of the profile and schedules its
+    renditions on the 'avatars' executor.
+
+    """
+    storage = profile.image.storage
+    previous = profile.image.name
+    with phase('storage'):
+        directory = avatar_directory(profile, upload.name)
+        name = store_avatar(storage, upload, directory)
+    profile.image.name = name
+    profile.save(update_fields=['image'])
+    # leave the replaced file to the orphan worker
+    if previous and previous != name:
+        record_orphan(previous)
+    get_executor('avatars').submit(render_renditions, storage, name)
+    return name
+
+
+def avatar_url(profile, size=None):
+    """Returns the immutable url of the avatar, or of the rendition in
+    the given size. Urls change with the content so they can be cached
+    forever.
+
+    """
+    if not profile.image:
+        return None
+    name = profile.image.name
+    if size is not None:
+        name = rendition_name(name, size)
+    return profile.image.storage.url(name)
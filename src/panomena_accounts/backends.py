@@ -0,0 +1,26 @@
+from django.contrib.auth import hashers
+from django.contrib.auth.models import User
+from django.contrib.auth.backends import ModelBackend
+
+from panomena_accounts import hashing
+
+
+class ExecutorModelBackend(ModelBackend):
+    """Model backend that checks passwords on the hashing executor."""
+
+    def authenticate(self, username=None, password=None):
+        try:
+            user = User._default_manager.get_by_natural_key(username)
+        except User.DoesNotExist:
+            return None
+        if not hashing.check_password(password, user.password):
+            return None
+        # upgrade hashes made with an outdated algorithm
+        try:
+            algorithm = hashers.identify_hasher(user.password).algorithm
+        except ValueError:
+            algorithm = None
+        if algorithm != hashers.get_hasher().algorithm:
+            hashing.set_password(user, password)
+            user.save(update_fields=['password'])
+        return user
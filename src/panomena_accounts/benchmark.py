@@ -0,0 +1,244 @@
+import os
+import sys
+import json
+import time
+import subprocess
+import random
+import resource
+from itertools import count
+
+import django
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.contrib.auth import hashers
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+
+from panomena_accounts.tokens import issue_reset_token
+from panomena_accounts.utils import get_profile_model, get_form_class
+
+
+BENCH_PASSWORD = 'benchmark'
+
+USERNAME = 'bench%07d'
+
+
+def generate_fixtures(users, chunk_size=5000, stdout=None):
+    """Creates the given number of users with profiles in bulk. All users
+    share one password hash so setup costs a single hasher call.
+
+    """
+    profile_model = get_profile_model()
+    password = hashers.make_password(BENCH_PASSWORD)
+    for start in range(0, users, chunk_size):
+        stop = min(start + chunk_size, users)
+        User.objects.bulk_create([
+            User(
+                username=USERNAME % i,
+                email='%s@example.com' % (USERNAME % i),
+                password=password,
+            )
+            for i in range(start, stop)
+        ])
+        pks = User.objects.filter(
+            username__gte=USERNAME % start,
+            username__lte=USERNAME % (stop - 1),
+        ).values_list('pk', flat=True)
+        profile_model.objects.bulk_create([
+            profile_model(user_id=pk) for pk in pks
+        ])
+        if stdout is not None:
+            stdout.write('Created %d of %d users\n' % (stop, users))
+
+
+def percentile(values, point):
+    """Returns the percentile of the sorted values."""
+    index = min(len(values) - 1, len(values) * point // 100)
+    return values[index]
+
+
+class Benchmark(object):
+    """Runs the accounts endpoints in process with the test client and
+    collects latency percentiles, query counts and peak memory.
+
+    """
+
+    def __init__(self, users, iterations=200, seed=0):
+        self.users = users
+        self.iterations = iterations
+        self.random = random.Random(seed)
+        self.sequence = count()
+
+    def random_username(self):
+        return USERNAME % self.random.randrange(self.users)
+
+    def logged_in_client(self, username):
+        client = Client()
+        client.login(username=username, password=BENCH_PASSWORD)
+        return client
+
+    def profile_data(self, username):
+        """Returns the profile form data of the user with a changed email
+        address, so every post passes validation and writes.
+
+        """
+        user = User.objects.get(username=username)
+        form = get_form_class('ACCOUNTS_PROFILE_FORM')(None, user=user)
+        data = dict(
+            (name, value) for name, value in form.initial.items()
+            if value is not None and value is not False
+        )
+        data['email'] = 'edited%d@example.com' % next(self.sequence)
+        return data
+
+    def endpoints(self):
+        """Returns the benchmarked endpoints as (name, client, method,
+        prepare) tuples, where prepare returns the url and data of a call
+        and runs outside of the measurement. Anonymous endpoints get their
+        own client so logins do not leak between them.
+
+        """
+        username = self.random_username()
+        user = self.logged_in_client(username)
+        login = lambda: (reverse('accounts_login'), {
+            'username': self.random_username(),
+            'password': BENCH_PASSWORD,
+        })
+        register = lambda: (reverse('accounts_register'), {
+            'username': 'newbench%07d' % next(self.sequence),
+            'email': 'new@example.com',
+            'password': BENCH_PASSWORD,
+            'confirm_password': BENCH_PASSWORD,
+        })
+        profile_display = lambda: (reverse('accounts_profile', kwargs={
+            'pk': User.objects.get(username=self.random_username()).pk,
+        }), {})
+        forgot = lambda: (reverse('accounts_forgot'), {
+            'username': self.random_username(),
+        })
+        reset = lambda: (reverse('accounts_reset', args=[
+            issue_reset_token(User.objects.get(
+                username=self.random_username()
+            ))
+        ]), {})
+        return [
+            ('login GET', Client(), 'get', login),
+            ('login POST', Client(), 'post', login),
+            ('register POST', Client(), 'post', register),
+            ('profile GET', user, 'get',
+                lambda: (reverse('accounts_profile'), {})),
+            ('profile POST', user, 'post',
+                lambda: (reverse('accounts_profile'),
+                    self.profile_data(username))),
+            ('profile display GET', Client(), 'get', profile_display),
+            ('forgot POST', Client(), 'post', forgot),
+            ('reset GET', Client(), 'get', reset),
+        ]
+
+    def measure(self, client, method, prepare):
+        """Returns the latencies, query counts, status codes and the
+        growth of the peak memory use of the iterations of an endpoint.
+
+        """
+        latencies = []
+        queries = []
+        statuses = {}
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        for i in range(self.iterations):
+            url, data = prepare()
+            if method == 'get':
+                data = {}
+            started = time.time()
+            response = getattr(client, method)(url, data)
+            latencies.append(time.time() - started)
+            # queries are reset when each request starts
+            queries.append(len(connection.queries))
+            statuses[response.status_code] = \
+                statuses.get(response.status_code, 0) + 1
+        # the peak covers the whole process, report what the endpoint added
+        growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - peak
+        return sorted(latencies), queries, statuses, growth
+
+    def run(self, stdout=None):
+        """Runs every endpoint and returns the report."""
+        debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        results = {}
+        try:
+            for name, client, method, prepare in self.endpoints():
+                latencies, queries, statuses, growth = self.measure(client,
+                    method, prepare)
+                results[name] = {
+                    'p50': percentile(latencies, 50),
+                    'p90': percentile(latencies, 90),
+                    'p99': percentile(latencies, 99),
+                    'mean': sum(latencies) / len(latencies),
+                    'queries': max(queries),
+                    'statuses': statuses,
+                    'peak_rss_growth_kb': growth,
+                }
+                if stdout is not None:
+                    stdout.write('%-20s p50 %7.2fms p99 %7.2fms %3d queries\n'
+                        % (name, results[name]['p50'] * 1000,
+                        results[name]['p99'] * 1000, max(queries)))
+        finally:
+            connection.use_debug_cursor = debug_cursor
+        return {
+            'meta': {
+                'users': self.users,
+                'iterations': self.iterations,
+                'python': sys.version.split()[0],
+                'django': django.get_version(),
+                'database': connection.vendor,
+            },
+            'results': results,
+        }
+
+
+def compare(report, baseline):
+    """Yields the relative change of each endpoint's p50 and p99 latency
+    and query count against the baseline report.
+
+    """
+    for name, result in sorted(report['results'].items()):
+        previous = baseline['results'].get(name)
+        if previous is None:
+            continue
+        changes = {}
+        for key in ('p50', 'p99', 'queries'):
+            if previous[key]:
+                changes[key] = result[key] / float(previous[key]) - 1
+        yield name, changes
+
+
+IMPORT_SCRIPT = """
+import sys, time, json
+started = time.time()
+import %s
+seconds = time.time() - started
+sys.stdout.write(json.dumps({'seconds': seconds, 'modules': list(sys.modules)}))
+"""
+
+# modules that should only load when the views needing them are used
+DEFERRED_MODULES = ('panomena_mobile', 'PIL', 'Image')
+
+
+def measure_import(module, runs=5):
+    """Imports the module in fresh interpreters and returns the fastest
+    import time in seconds and the deferred modules it loaded.
+
+    """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+    timings = []
+    for i in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, '-c', IMPORT_SCRIPT % module], env=env
+        )
+        result = json.loads(output)
+        timings.append(result['seconds'])
+    loaded = sorted(
+        name for name in result['modules']
+        if name.split('.')[0] in DEFERRED_MODULES
+    )
+    return min(timings), loaded
@@ -0,0 +1,97 @@
+import time
+import logging
+
+from django.db import transaction
+from django.core import mail
+from django.contrib.auth import hashers
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+
+from panomena_accounts.emails import ResetEmail
+from panomena_accounts.models import PasswordResetToken
+from panomena_accounts.tokens import build_reset_token, token_expiry
+
+
+logger = logging.getLogger('panomena_accounts.campaigns')
+
+
+class ResetCampaign(object):
+    """Forces password resets for a cohort of users. Tokens are issued
+    with one bulk insert per chunk and each chunk of messages is sent over
+    a single mail connection, optionally capped in messages per second.
+    With invalidate the current passwords of the whole cohort are made
+    unusable, including users without an email address.
+
+    """
+
+    def __init__(self, users, base_url, chunk_size=500, rate=None,
+            invalidate=False, start_after=0):
+        self.users = users
+        self.base_url = base_url.rstrip('/')
+        self.chunk_size = chunk_size
+        self.rate = rate
+        self.invalidate = invalidate
+        self.start_after = start_after
+        self.email = ResetEmail()
+        self.sent = 0
+        self.invalidated = 0
+
+    def reset_url(self, raw_token):
+        return self.base_url + reverse('accounts_reset', args=[raw_token])
+
+    def send_chunk(self, users):
+        """Invalidates the passwords of the users if requested, issues
+        tokens for those with an email address and sends their messages.
+
+        """
+        expires = token_expiry()
+        recipients = [user for user in users if user.email]
+        issued = [build_reset_token(user, expires) for user in recipients]
+        with transaction.commit_on_success():
+            if self.invalidate:
+                self.invalidated += User.objects.filter(
+                    pk__in=[user.pk for user in users]
+                ).update(password=hashers.make_password(None))
+            PasswordResetToken.objects.bulk_create(
+                [token for raw_token, token in issued]
+            )
+        messages = [
+            self.email.message(user, self.reset_url(raw_token))
+            for user, (raw_token, token) in zip(recipients, issued)
+        ]
+        connection = mail.get_connection()
+        try:
+            sent = connection.send_messages(messages)
+        except Exception:
+            logger.exception('Failed sending reset messages to users %d to '
+                '%d, resume with --start-after %d', users[0].pk,
+                users[-1].pk, users[0].pk - 1)
+            raise
+        if sent is not None and sent < len(messages):
+            logger.warning('Sent %d of %d reset messages to users %d to %d',
+                sent, len(messages), users[0].pk, users[-1].pk)
+        return len(messages) if sent is None else sent
+
+    def run(self, progress=None):
+        """Runs the campaign, calling progress with the number of sent
+        messages and the elapsed seconds after every chunk.
+
+        """
+        started = time.time()
+        last = self.start_after
+        while True:
+            users = self.users.filter(pk__gt=last).order_by('pk')
+            users = list(users[:self.chunk_size])
+            if not users:
+                break
+            self.sent += self.send_chunk(users)
+            last = users[-1].pk
+            elapsed = time.time() - started
+            if progress is not None:
+                progress(self.sent, elapsed)
+            # stay below the messages per second cap
+            if self.rate:
+                ahead = self.sent / float(self.rate) - elapsed
+                if ahead > 0:
+                    time.sleep(ahead)
+        return self.sent
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core import mail
+from django.template import Context
+
+from panomena_accounts.rendering import compiled
+
+
+class ResetEmail(object):
+    """Builds password reset messages from the compiled templates shared
+    with the accounts views.
+
+    """
+
+    subject = 'Password Reset Request'
+    text_template = 'accounts/forgot_email.txt'
+    html_template = 'accounts/forgot_email.html'
+
+    def __init__(self):
+        self.text = compiled(self.text_template)
+        self.html = compiled(self.html_template)
+
+    def message(self, user, url):
+        """Returns the reset message for the user with the reset url."""
+        context = Context({'user': user, 'url': url})
+        message = mail.EmailMultiAlternatives(
+            self.subject, self.text.render(context),
+            settings.DEFAULT_FROM_EMAIL, [user.email]
+        )
+        message.attach_alternative(self.html.render(context), 'text/html')
+        return message
@@ -9,3 +9,13 @@ class PasswordResetFieldException(Exception):
            "The 'password_reset' field is required " \
            "on the user profile model."
         ))
+
+
+class MobileNumberFieldException(Exception):
+    """Raised if the profile model has no 'mobile_number' field."""
+
+    def __init__(self):
+        super(MobileNumberFieldException, self).__init__(_(
+           "The 'mobile_number' field is required " \
+           "on the user profile model."
+        ))
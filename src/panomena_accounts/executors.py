@@ -0,0 +1,284 @@
+import time
+import Queue
+import logging
+import threading
+import multiprocessing
+
+from django.conf import settings
+
+
+logger = logging.getLogger('panomena_accounts.executors')
+
+
+class ExecutorTimeout(RuntimeError):
+    """Raised when waiting for the result of a call times out."""
+
+
+class Result(object):
+    """Handle on the outcome of a call submitted to an executor. Callers
+    may block on get() or register callbacks to be notified on completion.
+
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.callbacks = []
+        self.value = None
+        self.error = None
+        self.slot = False
+
+    def release_slot(self):
+        """Returns whether the call held an executor slot, only once, so
+        the slot is released either on completion or on timeout.
+
+        """
+        with self.lock:
+            held = self.slot
+            self.slot = False
+        return held
+
+    def set(self, value=None, error=None):
+        """Stores the outcome and runs the registered callbacks."""
+        with self.lock:
+            self.value = value
+            self.error = error
+            self.event.set()
+            callbacks = self.callbacks
+            self.callbacks = []
+        for callback in callbacks:
+            callback(self)
+
+    def add_callback(self, callback):
+        """Calls the callback with this result once it is ready."""
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback(self)
+
+    def ready(self):
+        """Returns whether the call has completed."""
+        return self.event.is_set()
+
+    def get(self, timeout=None):
+        """Waits for and returns the outcome of the call."""
+        if not self.event.wait(timeout):
+            raise ExecutorTimeout('Timed out waiting for executor result.')
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def call(func, args):
+    """Calls the function and captures its outcome so failures travel back
+    from worker processes like results do.
+
+    """
+    try:
+        return True, func(*args)
+    except Exception as e:
+        return False, e
+
+
+class BaseExecutor(object):
+    """Base executor running calls synchronously. Subclasses dispatch calls
+    to workers through a bounded queue and fall back to running them on the
+    calling thread when the queue is full.
+
+    """
+
+    def __init__(self, name, workers=1, queue_size=0, timeout=None):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(queue_size or 1)
+        self.submitted = 0
+        self.completed = 0
+        self.overflow = 0
+        self.timeouts = 0
+        self.released = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def dispatch(self, func, args, result, started):
+        """Hands the call to the workers."""
+        raise NotImplementedError
+
+    def submit(self, func, *args):
+        """Submits the call and returns its result handle."""
+        result = Result()
+        started = time.time()
+        with self.lock:
+            self.submitted += 1
+        # run on the calling thread when no slot is available
+        if not self.queue_size or not self.slots.acquire(False):
+            if self.queue_size:
+                with self.lock:
+                    self.overflow += 1
+            self.complete(result, started, call(func, args))
+            return result
+        result.slot = True
+        try:
+            self.dispatch(func, args, result, started)
+        except Exception:
+            if result.release_slot():
+                self.slots.release()
+            raise
+        return result
+
+    def run(self, func, *args):
+        """Submits the call and waits for its outcome. Calls taking longer
+        than the timeout, as those lost with a dead pool worker do, are
+        run again on the calling thread.
+
+        """
+        result = self.submit(func, *args)
+        try:
+            return result.get(self.timeout)
+        except ExecutorTimeout:
+            # a lost call never completes, free its slot for others
+            released = result.release_slot()
+            if released:
+                self.slots.release()
+            with self.lock:
+                self.timeouts += 1
+                self.released += released
+            logger.warning('Executor %s timed out, running the call '
+                'synchronously', self.name)
+            return func(*args)
+
+    def complete(self, result, started, outcome):
+        """Records the metrics for a finished call and stores its outcome."""
+        latency = time.time() - started
+        if result.release_slot():
+            self.slots.release()
+        with self.lock:
+            self.completed += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+        succeeded, value = outcome
+        if succeeded:
+            result.set(value=value)
+        else:
+            result.set(error=value)
+
+    def metrics(self):
+        """Returns the queue depth and latency metrics."""
+        with self.lock:
+            completed = self.completed
+            return {
+                'submitted': self.submitted,
+                'completed': completed,
+                'overflow': self.overflow,
+                'timeouts': self.timeouts,
+                'released_slots': self.released,
+                'depth': self.submitted - completed,
+                'mean_latency': completed and self.total_latency / completed,
+                'max_latency': self.max_latency,
+            }
+
+    def shutdown(self):
+        """Stops the workers of the executor."""
+        pass
+
+
+class SyncExecutor(BaseExecutor):
+    """Executor running every call on the calling thread."""
+
+    def __init__(self, name, workers=1, queue_size=0, timeout=None):
+        super(SyncExecutor, self).__init__(name, workers, 0)
+
+
+class ThreadExecutor(BaseExecutor):
+    """Executor running calls on a pool of worker threads."""
+
+    def __init__(self, name, workers=4, queue_size=64, timeout=30):
+        super(ThreadExecutor, self).__init__(name, workers, queue_size,
+            timeout)
+        self.queue = Queue.Queue()
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(
+                target=self.work,
+                name='%s-%d' % (name, i),
+            )
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def work(self):
+        """Runs queued calls until a stop marker is received."""
+        while True:
+            task = self.queue.get()
+            if task is None:
+                break
+            func, args, result, started = task
+            self.complete(result, started, call(func, args))
+
+    def dispatch(self, func, args, result, started):
+        self.queue.put((func, args, result, started))
+
+    def shutdown(self):
+        for thread in self.threads:
+            self.queue.put(None)
+
+
+class ProcessExecutor(BaseExecutor):
+    """Executor running calls on a pool of worker processes, suited to CPU
+    bound work such as password hashing. Functions and arguments must be
+    picklable.
+
+    """
+
+    def __init__(self, name, workers=None, queue_size=64, timeout=30):
+        workers = workers or multiprocessing.cpu_count()
+        super(ProcessExecutor, self).__init__(name, workers, queue_size,
+            timeout)
+        self.pool = multiprocessing.Pool(workers)
+
+    def dispatch(self, func, args, result, started):
+        callback = lambda outcome: self.complete(result, started, outcome)
+        self.pool.apply_async(call, (func, args), callback=callback)
+
+    def shutdown(self):
+        self.pool.close()
+        self.pool.join()
+
+
+EXECUTOR_BACKENDS = {
+    'sync': SyncExecutor,
+    'thread': ThreadExecutor,
+    'process': ProcessExecutor,
+}
+
+executors = {}
+executors_lock = threading.Lock()
+
+
+def get_executor(name):
+    """Returns the executor configured under the given name in the
+    ACCOUNTS_EXECUTORS setting, creating it on first use. Unconfigured
+    executors run calls synchronously. TIMEOUT bounds the seconds run()
+    waits before running a call on the calling thread.
+
+    """
+    try:
+        return executors[name]
+    except KeyError:
+        pass
+    with executors_lock:
+        if name not in executors:
+            config = getattr(settings, 'ACCOUNTS_EXECUTORS', {}).get(name, {})
+            backend = EXECUTOR_BACKENDS[config.get('BACKEND', 'sync')]
+            kwargs = {}
+            if 'WORKERS' in config:
+                kwargs['workers'] = config['WORKERS']
+            if 'QUEUE_SIZE' in config:
+                kwargs['queue_size'] = config['QUEUE_SIZE']
+            if 'TIMEOUT' in config:
+                kwargs['timeout'] = config['TIMEOUT']
+            executors[name] = backend(name, **kwargs)
+        return executors[name]
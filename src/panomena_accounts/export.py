@@ -0,0 +1,111 @@
+import csv
+
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.encoding import smart_str
+
+from panomena_general.utils import formfield_extractor
+
+from panomena_accounts.utils import get_profile_model
+
+
+# fields never exported
+EXCLUDED_FIELDS = ('password', 'user')
+
+
+def exportable_fields():
+    """Returns the exportable user and profile field names, taken from
+    the form field metadata of both models.
+
+    """
+    user_fields = sorted(
+        name for name in formfield_extractor(User, {})
+        if name not in EXCLUDED_FIELDS
+    )
+    profile_fields = sorted(
+        name for name in formfield_extractor(get_profile_model(), {})
+        if name not in EXCLUDED_FIELDS and name not in user_fields
+    )
+    return user_fields, profile_fields
+
+
+def select_fields(names=None):
+    """Splits the requested field names into user and profile fields,
+    defaulting to all exportable fields. Raises ValueError for unknown
+    names.
+
+    """
+    user_fields, profile_fields = exportable_fields()
+    if not names:
+        return user_fields, profile_fields
+    unknown = set(names) - set(user_fields) - set(profile_fields)
+    if unknown:
+        raise ValueError('Unknown fields: %s' % ', '.join(sorted(unknown)))
+    return (
+        [name for name in names if name in user_fields],
+        [name for name in names if name in profile_fields],
+    )
+
+
+def iter_accounts(user_fields, profile_fields, chunk_size=1000):
+    """Yields the values of every account, walking users in primary key
+    order a chunk at a time so memory use stays constant.
+
+    """
+    profiles = get_profile_model().objects
+    empty = (None,) * len(profile_fields)
+    last = 0
+    while True:
+        users = User.objects.filter(pk__gt=last).order_by('pk')
+        users = list(users.values_list('pk', *user_fields)[:chunk_size])
+        if not users:
+            break
+        pks = [row[0] for row in users]
+        values = {}
+        if profile_fields:
+            rows = profiles.filter(user__in=pks).values_list(
+                'user_id', *profile_fields
+            )
+            values = dict((row[0], row[1:]) for row in rows.iterator())
+        for row in users:
+            yield (row[0],) + row[1:] + values.get(row[0], empty)
+        last = pks[-1]
+
+
+class Echo(object):
+    """Pseudo buffer returning what is written to it."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(header, rows):
+    """Yields the header and rows as CSV lines."""
+    writer = csv.writer(Echo())
+    yield writer.writerow([smart_str(name) for name in header])
+    for row in rows:
+        yield writer.writerow([
+            smart_str(value) if value is not None else '' for value in row
+        ])
+
+
+def jsonl_lines(header, rows):
+    """Yields the rows as JSON objects, one per line."""
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(dict(zip(header, row))) + '\n'
+
+
+FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'jsonl': (jsonl_lines, 'application/x-ndjson'),
+}
+
+
+def export_lines(format='csv', names=None, chunk_size=1000):
+    """Returns the content type and a generator of exported lines."""
+    user_fields, profile_fields = select_fields(names)
+    header = ['id'] + user_fields + profile_fields
+    rows = iter_accounts(user_fields, profile_fields, chunk_size)
+    writer, content_type = FORMATS[format]
+    return content_type, writer(header, rows)
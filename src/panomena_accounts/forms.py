@@ -1,24 +1,57 @@
-import uuid
 import functools
+from collections import namedtuple, Mapping
 
 from django import forms
 from django.conf import settings
-from django.core import mail
 from django.core.urlresolvers import reverse
+from django.core.exceptions import MultipleObjectsReturned
 from django.utils.translation import ugettext_lazy as _
+from django.db.models.fields import FieldDoesNotExist
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import AuthenticationForm
-from django.template.loader import render_to_string
+from django.template import Context
 
-from panomena_mobile.fields import MsisdnField
 from panomena_general.utils import formfield_extractor
-from panomena_general.exceptions import ProfileRequiredException
 
-from panomena_accounts.utils import get_profile_model
-from panomena_accounts.exceptions import PasswordResetFieldException
+from panomena_accounts.utils import get_profile_model, get_profile
+from panomena_accounts import outbox, signals
+from panomena_accounts.avatars import save_avatar
+from panomena_accounts.availability import username_available
+from panomena_accounts.emails import ResetEmail
+from panomena_accounts.hashing import set_password
+from panomena_accounts.rendering import render_content
+from panomena_accounts.tokens import issue_reset_token
 
 
-USER_FIELDS = formfield_extractor(User, {})
+class LazyFormFields(Mapping):
+    """Read only mapping of the form fields of a model, extracted on first
+    access instead of at import time.
+
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.fields = None
+
+    def load(self):
+        if self.fields is None:
+            self.fields = formfield_extractor(self.model, {})
+        return self.fields
+
+    def __getitem__(self, name):
+        return self.load()[name]
+
+    def __contains__(self, name):
+        return name in self.load()
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        return len(self.load())
+
+
+USER_FIELDS = LazyFormFields(User)
 
 PASSWORD_FIELD = functools.partial(forms.CharField,
     required=True,
@@ -37,6 +70,8 @@ def next_to_initial(kwargs, request):
     if provided in the request parameters.
 
     """
+    if request is None:
+        return kwargs
     next = request.REQUEST.get('next', None)
     if next:
         initial = kwargs.get('initial', {})
@@ -45,6 +80,54 @@ def next_to_initial(kwargs, request):
     return kwargs
 
 
+FieldPlan = namedtuple('FieldPlan', 'user profile')
+
+FieldRoute = namedtuple('FieldRoute', 'name column comparable')
+
+
+def field_route(model, name):
+    """Returns the route of a form field onto the model or None if the
+    model has no such attribute. The route carries the column to save for
+    concrete fields and whether values can be compared before setting.
+
+    """
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        if hasattr(model, name):
+            return FieldRoute(name, None, False)
+        return None
+    if field.rel is not None:
+        return FieldRoute(name, field.name, False)
+    return FieldRoute(name, field.name, True)
+
+
+def apply_routes(obj, routes, data):
+    """Sets the routed values on the object and returns the changed
+    columns, or None when a value was set that does not map to a column.
+
+    """
+    changed = []
+    for route in routes:
+        if route.name not in data: continue
+        value = data[route.name]
+        # skip unchanged column values
+        if route.comparable and getattr(obj, route.name) == value: continue
+        setattr(obj, route.name, value)
+        if route.column is None:
+            changed = None
+        elif changed is not None:
+            changed.append(route.column)
+    return changed
+
+
+def save_changed(obj, changed):
+    """Saves the object, restricted to the changed columns if known."""
+    if obj.pk is None or changed is None:
+        obj.save()
+    elif changed:
+        obj.save(update_fields=changed)
+
 
 class LoginForm(AuthenticationForm):
     """Generic lgoin form base on django auth login form, but handles
@@ -59,6 +142,14 @@ class LoginForm(AuthenticationForm):
         # run the super method
         super(LoginForm, self).__init__(request, *args, **kwargs)
 
+    def check_for_test_cookie(self):
+        """Skip the test cookie check when the login page does not set
+        one, so no session is created for anonymous visitors.
+
+        """
+        if getattr(settings, 'ACCOUNTS_LOGIN_TEST_COOKIE', True):
+            super(LoginForm, self).check_for_test_cookie()
+
 
 class BaseProfileForm(forms.Form):
     """Generic form for saving and editing user profiles. It takes care of
@@ -82,22 +173,62 @@ class BaseProfileForm(forms.Form):
             # attempt to get the profile for the user
             profile_model = get_profile_model()
             try:
-                profile = user.get_profile()
+                profile = get_profile(user)
             except profile_model.DoesNotExist:
                 profile = None
             # update the initial values
-            self.update_field_values(user)
-            self.update_field_values(profile)
+            plan = self.field_plan()
+            self.update_field_values(user, plan.user)
+            if profile is not None:
+                self.update_field_values(profile, plan.profile)
         # use meta specifications
         if hasattr(self, 'Meta'):
             # apply field order if specified
             if hasattr(self.Meta, 'field_order'):
                 self.fields.keyOrder = self.Meta.field_order
 
-    def update_field_values(self, obj):
-        """Gathers field values from an object."""
+    def field_plan(self):
+        """Returns the plan routing the form fields onto the user and the
+        profile. Plans are computed once per form class and profile model.
+
+        """
+        cls = self.__class__
+        profile_model = get_profile_model()
+        key = (profile_model, frozenset(self.fields))
+        # keep the plans on the class itself, not on its bases
+        plans = cls.__dict__.get('field_plans')
+        if plans is None:
+            plans = {}
+            cls.field_plans = plans
+        try:
+            return plans[key]
+        except KeyError:
+            pass
+        user_routes = []
+        profile_routes = []
+        for name in self.fields:
+            if name in self.excluded_fields: continue
+            route = field_route(User, name)
+            if route is not None:
+                user_routes.append(route)
+            route = field_route(profile_model, name)
+            if route is not None:
+                profile_routes.append(route)
+        plan = FieldPlan(tuple(user_routes), tuple(profile_routes))
+        plans[key] = plan
+        return plan
+
+    def update_field_values(self, obj, routes=None):
+        """Gathers field values from an object, following the given routes
+        when provided.
+
+        """
         values = {}
-        if issubclass(obj.__class__, dict):
+        if routes is not None:
+            # extract values along the routes
+            for route in routes:
+                values[route.name] = getattr(obj, route.name)
+        elif issubclass(obj.__class__, dict):
             # extract values from dictionary
             for field in self.fields:
                 if field in self.excluded_fields: continue
@@ -117,15 +248,9 @@ class BaseProfileForm(forms.Form):
     def clean_username(self):
         """Check for unique username and clean value."""
         username = self.cleaned_data.get('username', None)
-        # check for user with same username
-        try:
-            user = User.objects.get(username=username)
-        except User.DoesNotExist:
+        # check for another user with the same username
+        if username_available(username, self.user):
             return username
-        # check for unchanged username
-        if self.user is not None:
-            if user.username == self.user.username:
-                return username
         # raise validation error
         raise forms.ValidationError(_('Username already in use by another user.'))
 
@@ -139,41 +264,44 @@ class BaseProfileForm(forms.Form):
         # return the cleaned data
         return cleaned_data
 
-    def save(self):
+    def save(self, fields=None):
         """Populates the user and profile objects with data from relevant 
-        fields and saves them.
+        fields and saves them. When field names are given only those
+        fields are applied.
         
         """
         cleaned_data = self.cleaned_data
+        if fields is not None:
+            cleaned_data = dict(
+                (key, value) for key, value in cleaned_data.items()
+                if key in fields
+            )
         profile_model = get_profile_model()
         user = self.user
         # construct the user if necessary
         if user is None: user = User()
         # get or construct the profile
         try:
-            profile = user.get_profile()
+            profile = get_profile(user)
         except profile_model.DoesNotExist:
             profile = profile_model()
         # set relative values on objects
-        for key, value in cleaned_data.items():
-            # skip excluded fields
-            if key in self.excluded_fields: continue
-            # set field values on user
-            if hasattr(user, key):
-                setattr(user, key, value)
-            # set field values on profile
-            if hasattr(profile, key):
-                setattr(profile, key, value)
+        plan = self.field_plan()
+        user_changed = apply_routes(user, plan.user, cleaned_data)
+        profile_changed = apply_routes(profile, plan.profile, cleaned_data)
         # set the user password
         password = cleaned_data.get('password', '')
         if len(password) > 0:
-            user.set_password(password)
-        # save the user
-        user.save()
+            set_password(user, password)
+            if user_changed is not None:
+                user_changed.append('password')
+        # save the changed user columns
+        save_changed(user, user_changed)
         # save the profile
         if profile.id is None:
             profile.user = user
-        profile.save()
+        save_changed(profile, profile_changed)
+        signals.profile_changed.send(sender=self.__class__, user=user)
         # return the user object
         return user
 
@@ -195,19 +323,23 @@ class AvatarForm(forms.Form):
         user = self.user
         try:
             avatar = self.cleaned_data['avatar']
-            profile = user.get_profile()
-            profile.image.save(avatar.name, avatar)
+            profile = get_profile(user)
+            save_avatar(profile, avatar)
         except profile_model.DoesNotExist:
             pass
+        else:
+            signals.profile_changed.send(sender=self.__class__, user=user)
         return user
 
 
 class ForgotForm(forms.Form):
     """Forgotten password form."""
 
-    username = USER_FIELDS['username'](help_text=None)
-
     def __init__(self, request, *args, **kwargs):
+        # the username field is extracted from the user model on first use
+        if 'username' not in self.base_fields:
+            self.base_fields['username'] = \
+                USER_FIELDS['username'](help_text=None)
         if request.method == 'POST':
             super(ForgotForm, self).__init__(request.POST, *args, **kwargs)
             if self.is_valid(): self.action(request)
@@ -227,33 +359,13 @@ class ForgotForm(forms.Form):
     def action(self, request):
         """Sends an email to the user with a link to change their password."""
         user = self.user
-        profile_model = get_profile_model()
-        # attempt to retrieve the user's profile
-        try:
-            profile = user.get_profile()
-        except profile_model.DoesNotExist:
-            raise ProfileRequiredException('password reset request')
-        # attempt to set the password reset field
-        reset_uuid = uuid.uuid4()
-        if hasattr(profile, 'password_reset'):
-            profile.password_reset = reset_uuid
-            profile.save()
-        else:
-            raise PasswordResetFieldException()
+        # issue a reset token for the user
+        reset_token = issue_reset_token(user)
         # generate the link to send in the email
-        url = reverse('accounts_reset', args=[reset_uuid])
+        url = reverse('accounts_reset', args=[reset_token])
         url = request.build_absolute_uri(url)
-        # build the context for email message template rendering
-        context = {'user': user, 'url': url}
-        # send rendered messages to managers
-        text_content = render_to_string('accounts/forgot_email.txt', context)
-        html_content = render_to_string('accounts/forgot_email.html', context)
-        message = mail.EmailMultiAlternatives(
-            'Password Reset Request', text_content,
-            settings.DEFAULT_FROM_EMAIL, [user.email]
-        )
-        message.attach_alternative(html_content, 'text/html')
-        message.send()
+        # send the rendered message
+        outbox.send(ResetEmail().message(user, url))
         # return success
         return True
 
@@ -277,13 +389,17 @@ class ResetForm(forms.Form):
 
 
 class ForgotSMSForm(forms.Form):
-    """SMS forgotten password form."""
+    """SMS forgotten password form. The mobile dependencies are only
+    imported once the form is used.
 
-    mobile_number = MsisdnField(
-        label='Mobile Number',
-    )
+    """
 
     def __init__(self, *args, **kwargs):
+        if 'mobile_number' not in self.base_fields:
+            from panomena_mobile.fields import MsisdnField
+            self.base_fields['mobile_number'] = MsisdnField(
+                label='Mobile Number',
+            )
         self.user = None
         super(ForgotSMSForm, self).__init__(*args, **kwargs)
 
@@ -292,16 +408,28 @@ class ForgotSMSForm(forms.Form):
         related to it.
         
         """
+        from panomena_accounts.sms import get_user_by_msisdn
         mobile_number = self.cleaned_data.get('mobile_number', None)
         # check for user with given mobile number
         try:
-            self.user = User.objects.get(mobile_number=mobile_number)
-        except User.DoesNotExist:
+            self.user = get_user_by_msisdn(mobile_number)
+        except MultipleObjectsReturned:
+            raise forms.ValidationError(_('This mobile number is registered '
+                'to more than one user, please contact support.'))
+        if self.user is None:
             raise forms.ValidationError(_('No user registered with this mobile number.'))
         # return the mobile number
         return mobile_number
 
-    def send(self):
-        """Sends an SMS tot he user containing the forgotten password."""
-        print self.cleaned_data
-
+    def send(self, request):
+        """Sends an SMS to the user containing a password reset link."""
+        from panomena_accounts.sms import send_sms
+        user = self.user
+        # issue a reset token for the user
+        reset_token = issue_reset_token(user)
+        url = reverse('accounts_reset', args=[reset_token])
+        url = request.build_absolute_uri(url)
+        # render and queue the message
+        context = Context({'user': user, 'url': url})
+        body = render_content('accounts/forgot_sms.txt', context)
+        send_sms(self.cleaned_data['mobile_number'], body.strip())
@@ -0,0 +1,27 @@
+from django.contrib.auth import hashers
+
+from panomena_accounts.executors import get_executor
+from panomena_accounts.instrumentation import phase
+
+
+def hashing_executor():
+    """Returns the executor password hashing is routed through."""
+    return get_executor('hashing')
+
+
+def make_password(raw_password):
+    """Hashes the password on the hashing executor."""
+    with phase('hash'):
+        return hashing_executor().run(hashers.make_password, raw_password)
+
+
+def check_password(raw_password, encoded):
+    """Checks the password against the hash on the hashing executor."""
+    with phase('hash'):
+        return hashing_executor().run(hashers.check_password,
+            raw_password, encoded)
+
+
+def set_password(user, raw_password):
+    """Sets the password of the user, hashing it on the executor."""
+    user.password = make_password(raw_password)
@@ -0,0 +1,212 @@
+import time
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.db.models.query_utils import deferred_class_factory
+from django.contrib.auth.models import User, SiteProfileNotAvailable
+
+from panomena_accounts.profile_cache import get_version, invalidate_profile
+from panomena_accounts.utils import registry, get_profile_model, \
+    get_profile
+
+
+class LocalSnapshots(object):
+    """In-process tier of recently used snapshots. Entries expire after a
+    short lifetime so changes made in other processes are picked up, and
+    the least recently used entries are evicted once the limit is reached.
+
+    """
+
+    def __init__(self, max_size=1000, timeout=5):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, pk, now):
+        with self.lock:
+            expires, snapshot = self.entries.pop(pk, (0, None))
+            if expires <= now:
+                return None
+            self.entries[pk] = (expires, snapshot)
+        return snapshot
+
+    def set(self, pk, snapshot, now):
+        with self.lock:
+            self.entries.pop(pk, None)
+            self.entries[pk] = (now + self.timeout, snapshot)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, pk):
+        with self.lock:
+            self.entries.pop(pk, None)
+
+
+def identity_cache():
+    """Returns the cache backend named by ACCOUNTS_IDENTITY_CACHE or None
+    when identity caching is disabled.
+
+    """
+    def loader():
+        alias = getattr(settings, 'ACCOUNTS_IDENTITY_CACHE', None)
+        return alias and get_cache(alias)
+    return registry.resolve('ACCOUNTS_IDENTITY_CACHE', loader)
+
+
+def local_snapshots():
+    """Returns the in-process tier configured by ACCOUNTS_IDENTITY_LOCAL."""
+    def loader():
+        config = getattr(settings, 'ACCOUNTS_IDENTITY_LOCAL', {})
+        return LocalSnapshots(
+            config.get('MAX_SIZE', 1000),
+            config.get('TIMEOUT', 5),
+        )
+    return registry.resolve('ACCOUNTS_IDENTITY_LOCAL', loader)
+
+
+# user columns never written to the shared cache
+EXCLUDED_FIELDS = ('password',)
+
+
+def snapshot_key(pk):
+    """Returns the shared cache key of the current snapshot of a user."""
+    return 'accounts:identity:2:%s:%r' % (pk, get_version(pk))
+
+
+def dump(instance):
+    """Returns the field values of the instance by attribute name, leaving
+    out the excluded fields.
+
+    """
+    return dict(
+        (f.attname, getattr(instance, f.attname))
+        for f in instance._meta.fields
+        if f.attname not in EXCLUDED_FIELDS
+    )
+
+
+def restore(model, values):
+    """Rebuilds a saved instance of the model from its field values."""
+    instance = model(**values)
+    instance._state.adding = False
+    return instance
+
+
+def snapshot_user_class():
+    """Returns the user model with the excluded fields deferred. Restored
+    users load the password hash on first access and saving them leaves
+    the stored hash alone.
+
+    """
+    return deferred_class_factory(User, EXCLUDED_FIELDS)
+
+
+def remember(user, profile):
+    """Stores the snapshot of the user and profile in both tiers."""
+    cache = identity_cache()
+    if not cache:
+        return
+    snapshot = (dump(user), dump(profile))
+    cache.set(snapshot_key(user.pk), snapshot,
+        getattr(settings, 'ACCOUNTS_IDENTITY_CACHE_TIMEOUT', 3600))
+    local_snapshots().set(user.pk, snapshot, time.time())
+
+
+def populate(user):
+    """Stores the snapshot of a freshly logged in user, unless the user
+    has no profile.
+
+    """
+    if not identity_cache():
+        return
+    try:
+        profile = get_profile(user)
+    except get_profile_model().DoesNotExist:
+        return
+    remember(user, profile)
+
+
+def recall(pk):
+    """Returns the cached user with its profile attached, or None when no
+    current snapshot of the user exists.
+
+    """
+    cache = identity_cache()
+    if not cache:
+        return None
+    local = local_snapshots()
+    now = time.time()
+    snapshot = local.get(pk, now)
+    if snapshot is None:
+        snapshot = cache.get(snapshot_key(pk))
+        if snapshot is None:
+            return None
+        local.set(pk, snapshot, now)
+    user_values, profile_values = snapshot
+    user = restore(snapshot_user_class(), user_values)
+    profile = restore(get_profile_model(), profile_values)
+    profile.user = user
+    user._profile_cache = profile
+    return user
+
+
+def forget(pk):
+    """Drops the local snapshot of the user. Shared snapshots are retired
+    by the version change of the profile.
+
+    """
+    if identity_cache():
+        local_snapshots().delete(pk)
+
+
+def profile_changed_handler(sender, user, **kwargs):
+    """Drops the snapshot of a user whose profile changed."""
+    forget(user.pk)
+
+
+def snapshot_owner(sender, instance):
+    """Returns the primary key of the user whose snapshot holds the saved
+    or deleted instance, or None if no snapshot holds it.
+
+    """
+    if issubclass(sender, User):
+        return instance.pk
+    try:
+        profile_model = get_profile_model()
+    except SiteProfileNotAvailable:
+        return None
+    if issubclass(sender, profile_model):
+        return instance.user_id
+    return None
+
+
+def saved_handler(sender, instance, update_fields=None, **kwargs):
+    """Retires the snapshots holding a saved user or profile, for example
+    after a password reset or an edit in the admin. Login time updates
+    are left alone, the login refreshes the snapshot itself.
+
+    """
+    if update_fields is not None and set(update_fields) == set(['last_login']):
+        return
+    if not identity_cache():
+        return
+    pk = snapshot_owner(sender, instance)
+    if pk is not None:
+        invalidate_profile(pk)
+        forget(pk)
+
+
+def deleted_handler(sender, instance, **kwargs):
+    """Retires the snapshots holding a deleted user or profile so deleted
+    accounts do not stay logged in.
+
+    """
+    if not identity_cache():
+        return
+    pk = snapshot_owner(sender, instance)
+    if pk is not None:
+        invalidate_profile(pk)
+        forget(pk)
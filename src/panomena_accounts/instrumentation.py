@@ -0,0 +1,157 @@
+import time
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from collections import deque
+
+from django.conf import settings
+from django.db import connections
+from django.utils.decorators import available_attrs
+
+from panomena_general.utils import class_from_string
+
+from panomena_accounts import signals
+
+
+local = threading.local()
+
+
+class Recording(object):
+    """Phase timings and query counts gathered during one view call."""
+
+    def __init__(self, view):
+        self.view = view
+        self.phases = []
+
+    def add(self, name, duration, queries):
+        self.phases.append((name, duration, queries))
+
+
+class InMemoryAggregator(object):
+    """Metrics sink keeping recent samples per view and phase and
+    reporting their percentiles.
+
+    """
+
+    def __init__(self, samples=1000):
+        self.samples = samples
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def add(self, key, duration):
+        with self.lock:
+            if key not in self.metrics:
+                self.metrics[key] = deque(maxlen=self.samples)
+            self.metrics[key].append(duration)
+
+    def record(self, view, duration, queries, phases):
+        self.add(view, duration)
+        for name, phase_duration, phase_queries in phases:
+            self.add('%s.%s' % (view, name), phase_duration)
+
+    def percentiles(self, key, points=(50, 90, 99)):
+        """Returns the requested percentiles of the key's durations."""
+        with self.lock:
+            values = sorted(self.metrics.get(key, ()))
+        if not values:
+            return {}
+        return dict(
+            (point, values[min(len(values) - 1, len(values) * point // 100)])
+            for point in points
+        )
+
+    def report(self):
+        """Returns the percentiles of every recorded view and phase."""
+        return dict((key, self.percentiles(key)) for key in self.metrics)
+
+
+def load_sink():
+    """Builds the sink named by ACCOUNTS_METRICS_SINK, if any."""
+    path = getattr(settings, 'ACCOUNTS_METRICS_SINK', None)
+    if path is None:
+        return None
+    return class_from_string(path)()
+
+
+def get_sink():
+    """Returns the configured metrics sink or None."""
+    # imported here as utils measures profile loads through this module
+    from panomena_accounts.utils import registry
+    return registry.resolve('ACCOUNTS_METRICS_SINK', load_sink)
+
+
+def enabled():
+    """Returns whether anything consumes the measurements."""
+    return get_sink() is not None or bool(signals.view_measured.receivers)
+
+
+def query_count():
+    """Returns the number of queries run so far on all connections,
+    including the read replicas.
+
+    """
+    return sum(len(c.queries) for c in connections.all())
+
+
+@contextmanager
+def phase(name):
+    """Measures the enclosed block as a phase of the current view call.
+    Does nothing outside instrumented views.
+
+    """
+    recording = getattr(local, 'recording', None)
+    if recording is None:
+        yield
+        return
+    queries = query_count()
+    started = time.time()
+    try:
+        yield
+    finally:
+        recording.add(name, time.time() - started, query_count() - queries)
+
+
+def instrumented(name):
+    """Decorator measuring the view and its phases when a metrics sink
+    or a view_measured receiver is present.
+
+    """
+    def decorator(view):
+        @wraps(view, assigned=available_attrs(view))
+        def wrapper(request, *args, **kwargs):
+            if not enabled() or getattr(local, 'recording', None):
+                return view(request, *args, **kwargs)
+            recording = local.recording = Recording(name)
+            # queries are only logged by debug cursors
+            debug_cursors = [
+                (c, c.use_debug_cursor) for c in connections.all()
+            ]
+            for c, debug_cursor in debug_cursors:
+                c.use_debug_cursor = True
+            queries = query_count()
+            started = time.time()
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                duration = time.time() - started
+                queries = query_count() - queries
+                for c, debug_cursor in debug_cursors:
+                    c.use_debug_cursor = debug_cursor
+                local.recording = None
+                emit(recording, duration, queries)
+        return wrapper
+    return decorator
+
+
+def emit(recording, duration, queries):
+    """Hands the measurements to the sink and the signal receivers."""
+    sink = get_sink()
+    if sink is not None:
+        sink.record(recording.view, duration, queries, recording.phases)
+    signals.view_measured.send(
+        sender=None,
+        view=recording.view,
+        duration=duration,
+        queries=queries,
+        phases=recording.phases,
+    )
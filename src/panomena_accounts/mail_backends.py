@@ -0,0 +1,54 @@
+import logging
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+
+from panomena_accounts.executors import get_executor
+
+
+logger = logging.getLogger('panomena_accounts.mail')
+
+
+def deliver(messages, backend, fail_silently):
+    """Sends the messages over a connection of the backend."""
+    connection = get_connection(backend, fail_silently=fail_silently)
+    return connection.send_messages(messages)
+
+
+def log_failure(result):
+    """Logs the error of a failed delivery, which no caller waits for."""
+    if result.error is not None:
+        logger.error('Failed sending email messages: %s', result.error,
+            exc_info=(type(result.error), result.error, None))
+
+
+class ExecutorEmailBackend(BaseEmailBackend):
+    """Email backend handing messages to the 'mail' executor, which sends
+    them through the backend named by ACCOUNTS_EXECUTOR_EMAIL_BACKEND.
+    Request threads only pay for queueing the messages.
+
+    """
+
+    def __init__(self, fail_silently=False, **kwargs):
+        super(ExecutorEmailBackend, self).__init__(fail_silently, **kwargs)
+        self.backend = getattr(settings, 'ACCOUNTS_EXECUTOR_EMAIL_BACKEND',
+            'django.core.mail.backends.smtp.EmailBackend')
+
+    def send_async(self, email_messages):
+        """Queues the messages and returns the executor result handle,
+        which resolves to the number of messages sent.
+
+        """
+        return get_executor('mail').submit(deliver, list(email_messages),
+            self.backend, self.fail_silently)
+
+    def send_messages(self, email_messages):
+        if not email_messages:
+            return 0
+        result = self.send_async(email_messages)
+        # failures of calls run on this thread reach the caller as usual
+        if result.ready() and not self.fail_silently:
+            return result.get()
+        result.add_callback(log_failure)
+        return len(email_messages)
@@ -0,0 +1,85 @@
+import json
+from optparse import make_option
+
+from django.db import connection
+from django.conf import settings
+from django.core.management.base import NoArgsCommand, CommandError
+from django.test.utils import setup_test_environment, \
+    teardown_test_environment
+
+from panomena_accounts.benchmark import Benchmark, generate_fixtures, \
+    compare, measure_import
+
+
+class Command(NoArgsCommand):
+    """Benchmarks the accounts endpoints against a throwaway test database
+    filled with synthetic users.
+
+    """
+
+    help = 'Benchmarks the accounts endpoints on a synthetic population.'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--users', type='int', default=100000,
+            help='Number of synthetic users and profiles.'),
+        make_option('--iterations', type='int', default=200,
+            help='Requests made per endpoint.'),
+        make_option('--seed', type='int', default=0,
+            help='Seed of the request randomization.'),
+        make_option('--output', default=None,
+            help='File to write the JSON report to.'),
+        make_option('--compare', default=None,
+            help='Earlier JSON report to compare the results with.'),
+        make_option('--imports', action='store_true', default=False,
+            help='Only check the import time of the package.'),
+        make_option('--import-budget', type='float', default=None,
+            help='Milliseconds importing the views may take, defaults to '
+                'ACCOUNTS_IMPORT_BUDGET.'),
+    )
+
+    def check_imports(self, budget):
+        """Fails if importing the views exceeds the budget or loads the
+        dependencies that should be deferred. The views are measured
+        rather than the urls, which only name them as strings.
+
+        """
+        seconds, loaded = measure_import('panomena_accounts.views')
+        self.stdout.write('Importing panomena_accounts.views took %.1fms\n'
+            % (seconds * 1000))
+        if loaded:
+            raise CommandError('Deferred modules imported at startup: %s'
+                % ', '.join(loaded))
+        if budget is not None and seconds * 1000 > budget:
+            raise CommandError('Import took longer than the %.1fms budget.'
+                % budget)
+
+    def handle_noargs(self, **options):
+        verbosity = int(options['verbosity'])
+        if options['imports']:
+            budget = options['import_budget']
+            if budget is None:
+                budget = getattr(settings, 'ACCOUNTS_IMPORT_BUDGET', None)
+            return self.check_imports(budget)
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity, autoclobber=True)
+        try:
+            generate_fixtures(options['users'],
+                stdout=self.stdout if verbosity > 1 else None)
+            benchmark = Benchmark(options['users'],
+                options['iterations'], options['seed'])
+            report = benchmark.run(self.stdout)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity)
+            teardown_test_environment()
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                baseline = json.load(baseline)
+            for name, changes in compare(report, baseline):
+                self.stdout.write('%-20s %s\n' % (name, ' '.join(
+                    '%s %+.1f%%' % (key, change * 100)
+                    for key, change in sorted(changes.items())
+                )))
@@ -0,0 +1,42 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from panomena_accounts.orphans import delete_orphans
+
+
+class Command(NoArgsCommand):
+    """Deletes orphaned avatar files from storage in batches."""
+
+    help = 'Deletes orphaned avatar files from storage.'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type='int', default=100,
+            help='Number of files deleted per batch.'),
+        make_option('--max-attempts', type='int', default=5,
+            help='Attempts before a file is parked.'),
+        make_option('--backoff', type='int', default=60,
+            help='Base delay in seconds between attempts.'),
+        make_option('--loop', action='store_true', default=False,
+            help='Keep deleting until interrupted.'),
+        make_option('--interval', type='float', default=30,
+            help='Seconds to sleep when no files are due.'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options['verbosity'])
+        while True:
+            deleted, failed = delete_orphans(
+                batch_size=options['batch_size'],
+                max_attempts=options['max_attempts'],
+                backoff=options['backoff'],
+            )
+            if verbosity > 1 and (deleted or failed):
+                self.stdout.write('Deleted %d, failed %d\n' % (deleted, failed))
+            # stop or wait once no files are due
+            if deleted or failed:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,41 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from panomena_accounts.export import FORMATS, export_lines
+
+
+class Command(NoArgsCommand):
+    """Streams all accounts with their profiles to a file."""
+
+    help = 'Exports accounts with their profiles as CSV or JSON lines.'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--format', choices=FORMATS.keys(), default='csv',
+            help='Output format.'),
+        make_option('--fields', default='',
+            help='Comma separated user and profile fields to export.'),
+        make_option('--chunk-size', type='int', default=1000,
+            help='Number of accounts fetched per query.'),
+        make_option('--output', default=None,
+            help='File to write to, standard output by default.'),
+    )
+
+    def handle_noargs(self, **options):
+        names = [n.strip() for n in options['fields'].split(',') if n.strip()]
+        try:
+            content_type, lines = export_lines(
+                options['format'], names, options['chunk_size']
+            )
+        except ValueError as e:
+            raise CommandError(e)
+        output = sys.stdout
+        if options['output']:
+            output = open(options['output'], 'wb')
+        try:
+            for line in lines:
+                output.write(line)
+        finally:
+            if output is not sys.stdout:
+                output.close()
@@ -0,0 +1,52 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from panomena_accounts.provisioning import AccountImporter, read_rows
+
+
+class Command(BaseCommand):
+    """Imports accounts in bulk from a CSV or JSON lines file."""
+
+    args = '<path>'
+    help = 'Imports accounts in bulk from a CSV or JSON lines file.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--format', choices=('csv', 'jsonl'), default=None,
+            help='Input format, derived from the extension by default.'),
+        make_option('--chunk-size', type='int', default=1000,
+            help='Number of rows created per transaction.'),
+        make_option('--processes', type='int', default=None,
+            help='Number of password hashing processes.'),
+        make_option('--checkpoint', default=None,
+            help='File recording progress, used to resume imports.'),
+        make_option('--errors', default=None,
+            help='File receiving rejected rows, standard error by default.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Provide the path of the file to import.')
+        path = args[0]
+        format = options['format']
+        if format is None:
+            format = 'csv' if path.endswith('.csv') else 'jsonl'
+        errors = sys.stderr
+        if options['errors']:
+            errors = open(options['errors'], 'a')
+        importer = AccountImporter(
+            chunk_size=options['chunk_size'],
+            processes=options['processes'],
+            checkpoint=options['checkpoint'],
+            errors=errors,
+        )
+        try:
+            with open(path, 'rb') as stream:
+                created, failed = importer.run(read_rows(stream, format))
+        finally:
+            if errors is not sys.stderr:
+                errors.close()
+        self.stdout.write('Created %d accounts, rejected %d rows.\n' % (
+            created, failed,
+        ))
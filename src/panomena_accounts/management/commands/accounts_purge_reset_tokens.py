@@ -0,0 +1,30 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from panomena_accounts.tokens import purge_expired_tokens
+
+
+class Command(NoArgsCommand):
+    """Deletes expired password reset tokens in bounded chunks."""
+
+    help = 'Deletes expired password reset tokens in bounded chunks.'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--chunk-size', type='int', default=1000,
+            help='Number of tokens deleted per statement.'),
+        make_option('--pause', type='float', default=0,
+            help='Seconds to sleep between chunks.'),
+    )
+
+    def handle_noargs(self, **options):
+        total = 0
+        chunks = purge_expired_tokens(
+            chunk_size=options['chunk_size'],
+            pause=options['pause'],
+        )
+        for deleted in chunks:
+            total += deleted
+            if int(options['verbosity']) > 1:
+                self.stdout.write('Deleted %d tokens\n' % deleted)
+        self.stdout.write('Purged %d expired reset tokens.\n' % total)
@@ -0,0 +1,35 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from panomena_accounts.orphans import find_orphans, record_orphan
+
+
+class Command(NoArgsCommand):
+    """Finds stored avatars no profile references and records them for
+    deletion.
+
+    """
+
+    help = 'Records stored avatar files no profile references.'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--path', default=None,
+            help='Storage directory to reconcile, ACCOUNTS_AVATAR_PATH or '
+                'the directory of the image field upload_to by default.'),
+        make_option('--chunk-size', type='int', default=500,
+            help='Number of files checked per query.'),
+        make_option('--dry-run', action='store_true', default=False,
+            help='Only list the orphaned files.'),
+    )
+
+    def handle_noargs(self, **options):
+        count = 0
+        orphans = find_orphans(options['path'], options['chunk_size'])
+        for name in orphans:
+            count += 1
+            if options['dry_run']:
+                self.stdout.write('%s\n' % name)
+            else:
+                record_orphan(name)
+        self.stdout.write('Found %d orphaned files.\n' % count)
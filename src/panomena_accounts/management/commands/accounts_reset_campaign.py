@@ -0,0 +1,68 @@
+import json
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import NoArgsCommand, CommandError
+
+from panomena_accounts.campaigns import ResetCampaign
+
+
+class Command(NoArgsCommand):
+    """Forces password resets for the users matching the filters."""
+
+    help = 'Issues reset tokens and emails to a cohort of users.'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--filter', action='append', default=[],
+            help='User queryset filter as lookup=value, value as JSON '
+                'where possible. May be repeated.'),
+        make_option('--base-url', default=None,
+            help='Site url reset links are built on, the current site '
+                'by default.'),
+        make_option('--chunk-size', type='int', default=500,
+            help='Number of users handled per chunk.'),
+        make_option('--rate', type='float', default=None,
+            help='Maximum number of messages sent per second.'),
+        make_option('--invalidate', action='store_true', default=False,
+            help='Make the current passwords of the users unusable.'),
+        make_option('--start-after', type='int', default=0,
+            help='Only handle users with a greater primary key, used to '
+                'resume a failed campaign.'),
+    )
+
+    def parse_filters(self, filters):
+        """Returns the queryset filters from lookup=value pairs."""
+        lookups = {}
+        for item in filters:
+            if '=' not in item:
+                raise CommandError('Invalid filter: %s' % item)
+            lookup, value = item.split('=', 1)
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+            lookups[str(lookup)] = value
+        return lookups
+
+    def progress(self, sent, elapsed):
+        self.stdout.write('Sent %d messages in %.1fs (%.1f/s)\n' % (
+            sent, elapsed, sent / max(elapsed, 0.001),
+        ))
+
+    def handle_noargs(self, **options):
+        users = User.objects.filter(**self.parse_filters(options['filter']))
+        base_url = options['base_url']
+        if base_url is None:
+            from django.contrib.sites.models import Site
+            base_url = 'http://%s' % Site.objects.get_current().domain
+        campaign = ResetCampaign(users, base_url,
+            chunk_size=options['chunk_size'],
+            rate=options['rate'],
+            invalidate=options['invalidate'],
+            start_after=options['start_after'],
+        )
+        sent = campaign.run(self.progress)
+        self.stdout.write('Campaign finished, sent %d messages.\n' % sent)
+        if options['invalidate']:
+            self.stdout.write('Invalidated %d passwords.\n'
+                % campaign.invalidated)
@@ -0,0 +1,42 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from panomena_accounts.outbox import drain
+
+
+class Command(NoArgsCommand):
+    """Sends queued account emails in batches over a reused connection."""
+
+    help = 'Sends queued account emails from the outbox.'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type='int', default=100,
+            help='Number of messages sent per connection.'),
+        make_option('--max-attempts', type='int', default=5,
+            help='Attempts before a message is parked.'),
+        make_option('--backoff', type='int', default=60,
+            help='Base delay in seconds between attempts.'),
+        make_option('--loop', action='store_true', default=False,
+            help='Keep draining the outbox until interrupted.'),
+        make_option('--interval', type='float', default=5,
+            help='Seconds to sleep when the outbox is empty.'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options['verbosity'])
+        while True:
+            sent, failed = drain(
+                batch_size=options['batch_size'],
+                max_attempts=options['max_attempts'],
+                backoff=options['backoff'],
+            )
+            if verbosity > 1 and (sent or failed):
+                self.stdout.write('Sent %d, failed %d\n' % (sent, failed))
+            # stop or wait once the outbox has been drained
+            if sent or failed:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth.models import AnonymousUser
+from django.utils.functional import SimpleLazyObject
+
+from panomena_accounts import identity
+from panomena_accounts.utils import get_profile_model
+
+
+def load_user(request):
+    """Loads the authenticated user and its profile from the identity
+    cache or else in a single query, falling back to the regular user
+    lookup for users without a profile.
+
+    """
+    try:
+        user_id = request.session[auth.SESSION_KEY]
+        backend_path = request.session[auth.BACKEND_SESSION_KEY]
+    except KeyError:
+        return AnonymousUser()
+    if backend_path not in settings.AUTHENTICATION_BACKENDS:
+        return AnonymousUser()
+    user = identity.recall(user_id)
+    if user is not None:
+        user.backend = backend_path
+        return user
+    profile_model = get_profile_model()
+    profiles = profile_model._default_manager.select_related('user')
+    try:
+        profile = profiles.get(user__pk=user_id)
+    except profile_model.DoesNotExist:
+        return auth.get_user(request)
+    user = profile.user
+    user.backend = backend_path
+    user._profile_cache = profile
+    identity.remember(user, profile)
+    return user
+
+
+class ProfileMiddleware(object):
+    """Replaces the lazy user set by the authentication middleware with
+    one that is loaded together with its profile. Must be installed after
+    django.contrib.auth.middleware.AuthenticationMiddleware.
+
+    """
+
+    def process_request(self, request):
+        request.user = SimpleLazyObject(lambda: load_user(request))
@@ -1,4 +1,123 @@
 from django.db import models
+from django.core.exceptions import ValidationError
+from django.db.models.signals import post_save, post_delete
+from django.utils import timezone
+from django.contrib.auth.models import User
+from django.utils.translation import ugettext_lazy as _
+
+from panomena_accounts import signals, profile_cache, availability, \
+    routers, identity
 
 
 PASSWORD_RESET_FIELD = models.CharField(max_length=36, blank=True, null=True)
+
+
+
+def normalize_msisdn(value):
+    """Returns the mobile number normalized by panomena_mobile, or the
+    stripped value if it does not validate. Blank numbers become None so
+    they do not collide in unique columns.
+
+    """
+    if not value:
+        return None
+    from panomena_mobile.fields import MsisdnField
+    try:
+        return MsisdnField(required=False).clean(value) or None
+    except ValidationError:
+        return value.strip()
+
+
+class MsisdnModelField(models.CharField):
+    """Mobile number column storing normalized numbers, so numbers saved
+    through forms or imports match lookups in any format. Lookups are
+    normalized the same way.
+
+    """
+
+    def pre_save(self, model_instance, add):
+        value = normalize_msisdn(getattr(model_instance, self.attname))
+        setattr(model_instance, self.attname, value)
+        return value
+
+    def get_prep_value(self, value):
+        value = super(MsisdnModelField, self).get_prep_value(value)
+        return normalize_msisdn(value)
+
+    def formfield(self, **kwargs):
+        from panomena_mobile.fields import MsisdnField
+        defaults = {'form_class': MsisdnField}
+        defaults.update(kwargs)
+        return super(MsisdnModelField, self).formfield(**defaults)
+
+
+MOBILE_NUMBER_FIELD = MsisdnModelField(max_length=32, blank=True, null=True,
+    unique=True)
+
+
+class PasswordResetToken(models.Model):
+    """Password reset token issued to a user. Only a hash of the token is
+    stored and a user may have several outstanding tokens.
+
+    """
+
+    user = models.ForeignKey(User, related_name='password_reset_tokens')
+    token_hash = models.CharField(_('token hash'), max_length=64, unique=True)
+    issued = models.DateTimeField(_('issued'), default=timezone.now)
+    expires = models.DateTimeField(_('expires'), db_index=True)
+
+    class Meta:
+        verbose_name = _('password reset token')
+        verbose_name_plural = _('password reset tokens')
+
+    def __unicode__(self):
+        return u'%s (%s)' % (self.user, self.expires)
+
+
+class OutboundEmail(models.Model):
+    """Email message queued for sending by the outbox worker."""
+
+    subject = models.CharField(_('subject'), max_length=255)
+    from_email = models.CharField(_('from email'), max_length=255)
+    recipients = models.TextField(_('recipients'))
+    body = models.TextField(_('body'))
+    html_body = models.TextField(_('html body'), blank=True)
+    created = models.DateTimeField(_('created'), default=timezone.now)
+    attempts = models.PositiveIntegerField(_('attempts'), default=0)
+    next_attempt = models.DateTimeField(_('next attempt'),
+        default=timezone.now, db_index=True)
+    last_error = models.TextField(_('last error'), blank=True)
+
+    class Meta:
+        verbose_name = _('outbound email')
+        verbose_name_plural = _('outbound emails')
+
+    def __unicode__(self):
+        return self.subject
+
+
+class OrphanedFile(models.Model):
+    """Stored file no longer referenced, waiting to be deleted."""
+
+    name = models.CharField(_('name'), max_length=255, unique=True)
+    created = models.DateTimeField(_('created'), default=timezone.now)
+    attempts = models.PositiveIntegerField(_('attempts'), default=0)
+    next_attempt = models.DateTimeField(_('next attempt'),
+        default=timezone.now, db_index=True)
+    last_error = models.TextField(_('last error'), blank=True)
+
+    class Meta:
+        verbose_name = _('orphaned file')
+        verbose_name_plural = _('orphaned files')
+
+    def __unicode__(self):
+        return self.name
+
+
+signals.profile_changed.connect(profile_cache.profile_changed_handler)
+signals.profile_changed.connect(identity.profile_changed_handler)
+post_save.connect(availability.user_saved_handler, sender=User)
+post_save.connect(identity.saved_handler)
+post_delete.connect(identity.deleted_handler)
+post_save.connect(routers.write_handler)
+post_delete.connect(routers.write_handler)
@@ -0,0 +1,149 @@
+import re
+import os
+from datetime import timedelta
+
+from django.utils import timezone
+
+from panomena_accounts.models import OrphanedFile
+from panomena_accounts.avatars import avatar_sizes, rendition_name, \
+    record_orphan, image_field, avatar_root
+from panomena_accounts.routers import primary_database
+from panomena_accounts.utils import get_profile_model
+
+
+# seconds a worker holds claimed files before others may retry them
+CLAIM_LEASE = 300
+
+RENDITION_SUFFIX = re.compile(r'_\d+x\d+(?=\.[^.]*$|$)')
+
+
+def avatar_storage():
+    """Returns the storage of the profile image field."""
+    return image_field().storage
+
+
+def clear_avatar(profile):
+    """Clears the avatar of the profile right away and leaves deleting the
+    file to the orphan worker.
+
+    """
+    name = profile.image.name
+    profile.image = None
+    profile.save(update_fields=['image'])
+    record_orphan(name)
+
+
+def candidate_names(name):
+    """Returns the names a profile may reference the stored file by, its
+    own name and, for renditions, the avatar it was rendered from. Both
+    are checked since legacy avatar names may look like renditions.
+
+    """
+    return set([name, RENDITION_SUFFIX.sub('', name)])
+
+
+def is_referenced(name):
+    """Returns whether a profile still uses the stored file or the avatar
+    it was rendered from.
+
+    """
+    # a lagging replica could miss a fresh reference
+    profiles = get_profile_model().objects.using(primary_database())
+    return profiles.filter(image__in=candidate_names(name)).exists()
+
+
+def claim(batch_size):
+    """Claims a batch of due orphans, skipping those claimed by other
+    workers in the meantime.
+
+    """
+    now = timezone.now()
+    lease = now + timedelta(seconds=CLAIM_LEASE)
+    due = OrphanedFile.objects.using(primary_database())
+    due = due.filter(next_attempt__lte=now)
+    due = due.order_by('next_attempt')[:batch_size]
+    claimed = []
+    for orphan in due:
+        updated = OrphanedFile.objects.filter(
+            pk=orphan.pk, next_attempt=orphan.next_attempt
+        ).update(next_attempt=lease)
+        if updated:
+            claimed.append(orphan)
+    return claimed
+
+
+def delete_orphans(batch_size=100, max_attempts=5, backoff=60):
+    """Deletes a batch of orphaned files with their renditions and returns
+    the number of deleted and failed files. Files that are referenced
+    again, as deduplicated avatars may be, are kept.
+
+    """
+    storage = avatar_storage()
+    done = []
+    failed = 0
+    for orphan in claim(batch_size):
+        if is_referenced(orphan.name):
+            done.append(orphan.pk)
+            continue
+        try:
+            names = [orphan.name]
+            names += [rendition_name(orphan.name, s) for s in avatar_sizes()]
+            for name in names:
+                if storage.exists(name):
+                    storage.delete(name)
+        except Exception as e:
+            attempts = orphan.attempts + 1
+            if attempts >= max_attempts:
+                delay = timedelta(days=365 * 100)
+            else:
+                delay = timedelta(seconds=backoff * 2 ** orphan.attempts)
+            OrphanedFile.objects.filter(pk=orphan.pk).update(
+                attempts=attempts,
+                next_attempt=timezone.now() + delay,
+                last_error=unicode(e),
+            )
+            failed += 1
+        else:
+            done.append(orphan.pk)
+    OrphanedFile.objects.filter(pk__in=done).delete()
+    return len(done), failed
+
+
+def walk_storage(storage, path):
+    """Yields the names of all files below the path in the storage."""
+    directories, files = storage.listdir(path)
+    for name in files:
+        yield os.path.join(path, name)
+    for directory in directories:
+        for name in walk_storage(storage, os.path.join(path, directory)):
+            yield name
+
+
+def find_orphans(path=None, chunk_size=500):
+    """Streams through the stored avatars and yields those no profile
+    references, checking references a chunk at a time. Scans the avatar
+    root unless another path is given.
+
+    """
+    if path is None:
+        path = avatar_root()
+    storage = avatar_storage()
+    profiles = get_profile_model().objects.using(primary_database())
+    chunk = []
+    names = walk_storage(storage, path)
+    while True:
+        for name in names:
+            chunk.append(name)
+            if len(chunk) >= chunk_size:
+                break
+        if not chunk:
+            break
+        # renditions belong to the avatar they were rendered from
+        candidates = dict((n, candidate_names(n)) for n in chunk)
+        referenced = set(profiles.filter(
+            image__in=set().union(*candidates.values())
+        ).values_list('image', flat=True))
+        for name in chunk:
+            if not candidates[name] & referenced:
+                yield name
+        chunk = []
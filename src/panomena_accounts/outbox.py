@@ -0,0 +1,123 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import mail
+from django.utils import timezone
+
+from panomena_accounts.models import OutboundEmail
+from panomena_accounts.instrumentation import phase
+from panomena_accounts.routers import primary_database
+
+
+# seconds a worker holds claimed messages before others may retry them
+CLAIM_LEASE = 300
+
+
+def enqueue(message):
+    """Stores an email message in the outbox and returns the record."""
+    html_body = ''
+    for content, mimetype in getattr(message, 'alternatives', []):
+        if mimetype == 'text/html':
+            html_body = content
+    return OutboundEmail.objects.create(
+        subject=message.subject,
+        from_email=message.from_email,
+        recipients='\n'.join(message.recipients()),
+        body=message.body,
+        html_body=html_body,
+    )
+
+
+def send(message):
+    """Sends the message through the outbox when it is enabled, otherwise
+    sends it immediately.
+
+    """
+    with phase('mail'):
+        if getattr(settings, 'ACCOUNTS_EMAIL_OUTBOX', False):
+            enqueue(message)
+        else:
+            message.send()
+
+
+def build_message(email):
+    """Constructs the email message from an outbox record."""
+    message = mail.EmailMultiAlternatives(
+        email.subject, email.body, email.from_email,
+        email.recipients.split('\n'),
+    )
+    if email.html_body:
+        message.attach_alternative(email.html_body, 'text/html')
+    return message
+
+
+def claim(batch_size):
+    """Claims a batch of due messages, skipping those claimed by other
+    workers in the meantime.
+
+    """
+    now = timezone.now()
+    lease = now + timedelta(seconds=CLAIM_LEASE)
+    due = OutboundEmail.objects.using(primary_database())
+    due = due.filter(next_attempt__lte=now)
+    due = due.order_by('next_attempt')[:batch_size]
+    claimed = []
+    for email in due:
+        updated = OutboundEmail.objects.filter(
+            pk=email.pk, next_attempt=email.next_attempt
+        ).update(next_attempt=lease)
+        if updated:
+            claimed.append(email)
+    return claimed
+
+
+def retry_later(email, error, backoff, max_attempts):
+    """Records a failed attempt and schedules the next one with an
+    exponential backoff. Messages out of attempts are parked indefinitely.
+
+    """
+    attempts = email.attempts + 1
+    if attempts >= max_attempts:
+        delay = timedelta(days=365 * 100)
+    else:
+        delay = timedelta(seconds=backoff * 2 ** email.attempts)
+    OutboundEmail.objects.filter(pk=email.pk).update(
+        attempts=attempts,
+        next_attempt=timezone.now() + delay,
+        last_error=unicode(error),
+    )
+
+
+def drain(batch_size=100, max_attempts=5, backoff=60, connection=None):
+    """Sends a batch of due messages over a single connection and returns
+    the number of sent and failed messages.
+
+    """
+    claimed = claim(batch_size)
+    if not claimed:
+        return 0, 0
+    if connection is None:
+        connection = mail.get_connection()
+    # open the connection once for the whole batch
+    try:
+        connection.open()
+    except Exception as e:
+        for email in claimed:
+            retry_later(email, e, backoff, max_attempts)
+        return 0, len(claimed)
+    sent = []
+    failed = 0
+    try:
+        for email in claimed:
+            try:
+                connection.send_messages([build_message(email)])
+            except Exception as e:
+                retry_later(email, e, backoff, max_attempts)
+                failed += 1
+            else:
+                sent.append(email.pk)
+    finally:
+        connection.close()
+    # sent messages leave the outbox
+    OutboundEmail.objects.filter(pk__in=sent).delete()
+    return len(sent), failed
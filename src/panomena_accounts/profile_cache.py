@@ -0,0 +1,105 @@
+import time
+import hashlib
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import get_cache
+
+from panomena_accounts.utils import registry
+
+
+# seconds to wait for another worker rendering the same page
+RENDER_WAIT = 2.0
+RENDER_POLL = 0.05
+
+
+def profile_cache():
+    """Returns the cache backend named by ACCOUNTS_PROFILE_CACHE."""
+    return registry.resolve('ACCOUNTS_PROFILE_CACHE', lambda: get_cache(
+        getattr(settings, 'ACCOUNTS_PROFILE_CACHE', 'default')
+    ))
+
+
+def cache_timeout():
+    """Returns the lifetime of cached profile versions and pages."""
+    return getattr(settings, 'ACCOUNTS_PROFILE_CACHE_TIMEOUT', 24 * 3600)
+
+
+def version_key(pk):
+    return 'accounts:profile:version:%s' % pk
+
+
+def get_version(pk):
+    """Returns the version of the profile, the time it last changed."""
+    cache = profile_cache()
+    key = version_key(pk)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time(), cache_timeout())
+        version = cache.get(key) or time.time()
+    return version
+
+
+def invalidate_profile(pk):
+    """Moves the profile to a new version, retiring its cached pages."""
+    profile_cache().set(version_key(pk), time.time(), cache_timeout())
+
+
+def profile_changed_handler(sender, user, **kwargs):
+    """Invalidates the cached pages of a changed profile."""
+    invalidate_profile(user.pk)
+
+
+def page_etag(request, pk):
+    """Returns the entity tag of a profile page as seen by the viewer."""
+    viewer = request.user.pk if request.user.is_authenticated() else ''
+    value = '%s:%r:%s' % (pk, get_version(pk), viewer)
+    return hashlib.md5(value).hexdigest()
+
+
+def page_last_modified(request, pk):
+    """Returns the time the profile page last changed."""
+    return datetime.utcfromtimestamp(get_version(pk))
+
+
+# cached in place of pages that must not be shared
+UNCACHEABLE = False
+
+
+def cached_page(request, pk, render):
+    """Returns the cached content of the profile page, rendering it if
+    needed. Only one worker renders a missing page at a time, the others
+    wait briefly for its result. Pages that used the csrf token of the
+    request are personal, they are marked uncacheable so later requests
+    render their own without waiting.
+
+    """
+    cache = profile_cache()
+    key = 'accounts:profile:page:%s:%r' % (pk, get_version(pk))
+    content = cache.get(key)
+    if content is UNCACHEABLE:
+        return render()
+    if content is not None:
+        return content
+    lock_key = key + ':lock'
+    if cache.add(lock_key, 1, int(RENDER_WAIT) + 1):
+        try:
+            content = render()
+            if request.META.get('CSRF_COOKIE_USED'):
+                cache.set(key, UNCACHEABLE, cache_timeout())
+            else:
+                cache.set(key, content, cache_timeout())
+        finally:
+            cache.delete(lock_key)
+        return content
+    # wait for the worker holding the lock
+    waited = 0
+    while waited < RENDER_WAIT:
+        time.sleep(RENDER_POLL)
+        waited += RENDER_POLL
+        content = cache.get(key)
+        if content is UNCACHEABLE:
+            break
+        if content is not None:
+            return content
+    return render()
@@ -0,0 +1,209 @@
+import csv
+import json
+import multiprocessing
+from itertools import islice
+
+from django.db import transaction, IntegrityError
+from django.contrib.auth import hashers
+from django.contrib.auth.models import User
+
+from panomena_accounts import availability
+from panomena_accounts.forms import apply_routes
+from panomena_accounts.utils import get_profile_model, get_form_class
+
+
+def decode_row(row):
+    """Returns the decoded values of a CSV row, raising ValueError when
+    the row has missing or extra columns.
+
+    """
+    if None in row:
+        raise ValueError('Row has more columns than the header.')
+    if None in row.values():
+        raise ValueError('Row has fewer columns than the header.')
+    return dict((key, value.decode('utf-8')) for key, value in row.items())
+
+
+def decode_line(content):
+    """Returns the values of a JSON line, raising ValueError when the line
+    does not hold an object.
+
+    """
+    values = json.loads(content)
+    if not isinstance(values, dict):
+        raise ValueError('Line does not hold a JSON object.')
+    return values
+
+
+def read_rows(stream, format='csv'):
+    """Yields the line number, values and errors of each row in a CSV or
+    JSON lines stream. Malformed rows come with errors instead of values
+    so they can be rejected without aborting the import.
+
+    """
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            try:
+                yield reader.line_num, decode_row(row), None
+            except (ValueError, UnicodeDecodeError) as e:
+                yield reader.line_num, None, {'__all__': [unicode(e)]}
+    else:
+        for line, content in enumerate(stream, 1):
+            content = content.strip()
+            if not content:
+                continue
+            try:
+                yield line, decode_line(content), None
+            except ValueError as e:
+                yield line, None, {'__all__': [unicode(e)]}
+
+
+def bulk_form_class(form_class):
+    """Returns a subclass of the form that leaves username uniqueness to
+    the chunk level check instead of querying per row.
+
+    """
+    def clean_username(self):
+        return self.cleaned_data.get('username', None)
+    name = 'Bulk%s' % form_class.__name__
+    return type(name, (form_class,), {'clean_username': clean_username})
+
+
+def read_checkpoint(path):
+    """Returns the last line imported according to the checkpoint."""
+    try:
+        with open(path) as checkpoint:
+            return int(checkpoint.read().strip() or 0)
+    except (IOError, TypeError):
+        return 0
+
+
+def write_checkpoint(path, line):
+    """Records the last line imported."""
+    if path:
+        with open(path, 'w') as checkpoint:
+            checkpoint.write('%d\n' % line)
+
+
+class AccountImporter(object):
+    """Validates rows with the registration form rules, hashes passwords
+    in a process pool and creates users and profiles in chunks.
+
+    """
+
+    def __init__(self, chunk_size=1000, processes=None, checkpoint=None,
+            errors=None):
+        self.chunk_size = chunk_size
+        self.processes = processes
+        self.checkpoint = checkpoint
+        self.errors = errors
+        self.form_class = bulk_form_class(
+            get_form_class('ACCOUNTS_REGISTER_FORM')
+        )
+        self.created = 0
+        self.failed = 0
+
+    def report(self, line, errors):
+        """Records the errors of a rejected row."""
+        self.failed += 1
+        if self.errors is not None:
+            self.errors.write(json.dumps({'line': line, 'errors': errors}))
+            self.errors.write('\n')
+
+    def validate(self, chunk):
+        """Returns the valid forms of the chunk, reporting the others."""
+        valid = []
+        usernames = set()
+        for line, values, errors in chunk:
+            if errors is not None:
+                self.report(line, errors)
+                continue
+            form = self.form_class(None, values)
+            if not form.is_valid():
+                self.report(line, dict(
+                    (name, [unicode(e) for e in errors])
+                    for name, errors in form.errors.items()
+                ))
+                continue
+            username = form.cleaned_data['username']
+            if username in usernames:
+                self.report(line, {'username': ['Duplicate username.']})
+                continue
+            usernames.add(username)
+            valid.append((line, form))
+        # reject usernames already taken
+        existing = set(User.objects.filter(
+            username__in=usernames
+        ).values_list('username', flat=True))
+        for line, form in valid:
+            if form.cleaned_data['username'] in existing:
+                self.report(line, {'username': ['Username already in use.']})
+        return [(line, form) for line, form in valid
+            if form.cleaned_data['username'] not in existing]
+
+    def create(self, valid, passwords):
+        """Creates the users and profiles of the valid forms. When a
+        username was taken after validation the chunk is retried row by
+        row, rejecting the conflicting rows.
+
+        """
+        try:
+            self.create_chunk([form for line, form in valid], passwords)
+        except IntegrityError:
+            for (line, form), password in zip(valid, passwords):
+                try:
+                    self.create_chunk([form], [password])
+                except IntegrityError as e:
+                    self.report(line, {'__all__': [unicode(e)]})
+
+    def create_chunk(self, forms, passwords):
+        """Creates the users and profiles of the forms in a transaction."""
+        profile_model = get_profile_model()
+        users = []
+        with transaction.commit_on_success():
+            for form, password in zip(forms, passwords):
+                user = User()
+                apply_routes(user, form.field_plan().user, form.cleaned_data)
+                user.password = password
+                users.append(user)
+            User.objects.bulk_create(users)
+            # bulk inserts do not return keys, look them up by username
+            pks = dict(User.objects.filter(
+                username__in=[created.username for created in users]
+            ).values_list('username', 'pk'))
+            profiles = []
+            for form, user in zip(forms, users):
+                profile = profile_model()
+                plan = form.field_plan()
+                apply_routes(profile, plan.profile, form.cleaned_data)
+                profile.user_id = pks[user.username]
+                profiles.append(profile)
+            profile_model.objects.bulk_create(profiles)
+        for user in users:
+            availability.user_saved_handler(User, user)
+        self.created += len(users)
+
+    def run(self, rows):
+        """Imports the rows, resuming after the checkpoint."""
+        start = read_checkpoint(self.checkpoint)
+        rows = (row for row in rows if row[0] > start)
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            while True:
+                chunk = list(islice(rows, self.chunk_size))
+                if not chunk:
+                    break
+                valid = self.validate(chunk)
+                forms = [form for line, form in valid]
+                passwords = pool.map(hashers.make_password, [
+                    form.cleaned_data.get('password') or None
+                    for form in forms
+                ])
+                if valid:
+                    self.create(valid, passwords)
+                write_checkpoint(self.checkpoint, chunk[-1][0])
+        finally:
+            pool.close()
+            pool.join()
+        return self.created, self.failed
@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.http import HttpResponse
+from django.template import Context, RequestContext
+from django.template.loader import get_template
+from django.core.context_processors import csrf
+from django.test.signals import setting_changed
+
+from panomena_accounts.instrumentation import phase
+
+
+templates = {}
+
+
+def compiled(name):
+    """Returns the compiled template, loading and parsing it only once per
+    process. Templates are reloaded on every use while TEMPLATE_DEBUG is
+    on so edits show up during development.
+
+    """
+    try:
+        return templates[name]
+    except KeyError:
+        pass
+    template = get_template(name)
+    if not settings.TEMPLATE_DEBUG:
+        templates[name] = template
+    return template
+
+
+def templates_changed_handler(sender, setting, **kwargs):
+    """Drops the compiled templates when the template settings change."""
+    if setting.startswith('TEMPLATE'):
+        templates.clear()
+
+setting_changed.connect(templates_changed_handler)
+
+
+def build_context(request, data=None, fragment=False):
+    """Builds the context for the request in one pass. Plain fragments
+    skip the context processors and only receive the csrf token, so they
+    are opt in for templates that need nothing else, by passing
+    fragment=True to the login or forgot view in the url configuration.
+
+    """
+    if fragment:
+        context = Context(data)
+        context.update(csrf(request))
+        return context
+    return RequestContext(request, data)
+
+
+def render_content(template, context):
+    """Renders the template to a string, measured as a render phase of
+    the template.
+
+    """
+    with phase('render:%s' % template):
+        return compiled(template).render(context)
+
+
+def render(request, template, data=None, fragment=False):
+    """Renders the template with the data to a response."""
+    context = build_context(request, data, fragment)
+    return HttpResponse(render_content(template, context))
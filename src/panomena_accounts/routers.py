@@ -0,0 +1,109 @@
+import time
+import random
+import threading
+
+from django.conf import settings
+from django.contrib.auth.models import User, SiteProfileNotAvailable
+
+from panomena_accounts.utils import get_profile_model
+
+
+local = threading.local()
+
+PIN_COOKIE = 'accounts_primary'
+
+
+def primary_database():
+    """Returns the alias of the database receiving writes."""
+    return getattr(settings, 'ACCOUNTS_WRITE_DATABASE', 'default')
+
+
+def replica_databases():
+    """Returns the aliases of the databases serving reads."""
+    return getattr(settings, 'ACCOUNTS_READ_DATABASES', ())
+
+
+def pin_window():
+    """Returns the seconds reads stick to the primary after a write."""
+    return getattr(settings, 'ACCOUNTS_PRIMARY_PIN_SECONDS', 10)
+
+
+def is_pinned():
+    """Returns whether reads of the current thread go to the primary."""
+    return getattr(local, 'pinned', False)
+
+
+def pin_to_primary():
+    """Sends the following reads of the current thread to the primary
+    and marks the request as having written.
+
+    """
+    local.pinned = True
+    local.wrote = True
+
+
+def is_routed(model):
+    """Returns whether the model is one of the account models."""
+    # deferred classes, such as cached users, subclass their model
+    if issubclass(model, User) or model._meta.app_label == 'panomena_accounts':
+        return True
+    try:
+        return issubclass(model, get_profile_model())
+    except SiteProfileNotAvailable:
+        return False
+
+
+def write_handler(sender, **kwargs):
+    """Pins the current thread to the primary after account writes."""
+    if is_routed(sender):
+        pin_to_primary()
+
+
+class AccountsRouter(object):
+    """Routes reads of the account models to the replicas named in
+    ACCOUNTS_READ_DATABASES and their writes to ACCOUNTS_WRITE_DATABASE.
+    Reads stick to the primary after a write by the same user.
+
+    """
+
+    def db_for_read(self, model, **hints):
+        if not is_routed(model):
+            return None
+        replicas = replica_databases()
+        if is_pinned() or not replicas:
+            return primary_database()
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        if not is_routed(model):
+            return None
+        return primary_database()
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_routed(obj1.__class__) and is_routed(obj2.__class__):
+            return True
+        return None
+
+
+class ReplicaPinningMiddleware(object):
+    """Keeps the reads of a user on the primary for a while after they
+    wrote, using a cookie holding the end of the pinned window.
+
+    """
+
+    def process_request(self, request):
+        local.wrote = False
+        try:
+            pinned_until = float(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        local.pinned = pinned_until > time.time()
+
+    def process_response(self, request, response):
+        if getattr(local, 'wrote', False):
+            window = pin_window()
+            response.set_cookie(PIN_COOKIE, str(time.time() + window),
+                max_age=window)
+        local.wrote = False
+        local.pinned = False
+        return response
@@ -0,0 +1,9 @@
+from django.dispatch import Signal
+
+
+# sent when the user or profile data of an account is changed
+profile_changed = Signal(providing_args=['user'])
+
+# sent with the timings of an instrumented accounts view
+view_measured = Signal(providing_args=['view', 'duration', 'queries',
+    'phases'])
@@ -0,0 +1,190 @@
+import sys
+import time
+import Queue
+import logging
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models.fields import FieldDoesNotExist
+
+from panomena_general.utils import class_from_string
+
+from panomena_accounts.utils import registry, get_profile_model
+from panomena_accounts.instrumentation import phase
+from panomena_accounts.exceptions import MobileNumberFieldException
+
+
+logger = logging.getLogger('panomena_accounts.sms')
+
+SMSMessage = namedtuple('SMSMessage', 'recipient body')
+
+
+def get_user_by_msisdn(msisdn):
+    """Returns the user whose profile has the normalized mobile number,
+    with the profile attached, or None if there is none. Raises the
+    profile model's MultipleObjectsReturned when the number is shared,
+    which unique mobile number columns rule out.
+
+    """
+    profile_model = get_profile_model()
+    try:
+        profile_model._meta.get_field('mobile_number')
+    except FieldDoesNotExist:
+        raise MobileNumberFieldException()
+    profiles = profile_model._default_manager.select_related('user')
+    try:
+        with phase('profile'):
+            profile = profiles.get(mobile_number=msisdn)
+    except profile_model.DoesNotExist:
+        return None
+    user = profile.user
+    user._profile_cache = profile
+    return user
+
+
+class BaseSMSBackend(object):
+    """Base class for SMS gateway backends."""
+
+    # number of messages the gateway accepts per call
+    batch_size = 100
+
+    def send_messages(self, messages):
+        """Sends the messages and returns the number sent."""
+        raise NotImplementedError
+
+
+class ConsoleBackend(BaseSMSBackend):
+    """Writes messages to standard output."""
+
+    def send_messages(self, messages):
+        for message in messages:
+            sys.stdout.write('SMS to %s: %s\n' % message)
+        sys.stdout.flush()
+        return len(messages)
+
+
+# messages sent through the locmem backend
+outbox = []
+
+
+class LocmemBackend(BaseSMSBackend):
+    """Keeps messages in the module level outbox, for testing."""
+
+    def send_messages(self, messages):
+        outbox.extend(messages)
+        return len(messages)
+
+
+class FileBackend(BaseSMSBackend):
+    """Appends messages to the file named by ACCOUNTS_SMS_FILE_PATH."""
+
+    def send_messages(self, messages):
+        with open(settings.ACCOUNTS_SMS_FILE_PATH, 'a') as output:
+            for message in messages:
+                output.write('%s\t%s\n' % message)
+        return len(messages)
+
+
+class SMSDispatcher(object):
+    """Sends queued messages in batches on a background thread without
+    exceeding the configured messages per second. The queue and the rate
+    are per process, so N worker processes may send N times the rate.
+    Messages arriving at a full queue are sent on the calling thread and
+    failed batches are retried with exponential backoff.
+
+    """
+
+    def __init__(self, backend, rate=None, queue_size=1000, retries=3,
+            backoff=1.0):
+        self.backend = backend
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.queue = Queue.Queue(queue_size)
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def enqueue(self, message):
+        """Queues the message, starting the worker thread if needed."""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.work,
+                    name='accounts-sms')
+                self.thread.daemon = True
+                self.thread.start()
+        try:
+            self.queue.put_nowait(message)
+        except Queue.Full:
+            logger.warning('SMS queue full, sending on the calling thread')
+            self.deliver([message])
+
+    def next_batch(self):
+        """Waits for a message and collects the queued ones after it."""
+        batch = [self.queue.get()]
+        while len(batch) < self.backend.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Queue.Empty:
+                break
+        return batch
+
+    def deliver(self, batch):
+        """Sends the batch, retrying failures before giving up on it."""
+        for attempt in range(self.retries + 1):
+            try:
+                return self.backend.send_messages(batch)
+            except Exception:
+                if attempt == self.retries:
+                    logger.exception('Failed sending %d messages, giving '
+                        'up after %d attempts', len(batch), attempt + 1)
+                    return 0
+                logger.warning('Failed sending %d messages, retrying',
+                    len(batch), exc_info=True)
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def work(self):
+        """Sends batches until the process exits."""
+        while True:
+            batch = self.next_batch()
+            started = time.time()
+            try:
+                self.deliver(batch)
+            finally:
+                for message in batch:
+                    self.queue.task_done()
+            # wait until the batch fits within the rate
+            if self.rate:
+                remaining = len(batch) / float(self.rate)
+                remaining -= time.time() - started
+                if remaining > 0:
+                    time.sleep(remaining)
+
+    def flush(self):
+        """Blocks until every queued message has been handled."""
+        self.queue.join()
+
+
+def load_dispatcher():
+    """Builds the dispatcher for ACCOUNTS_SMS_BACKEND. ACCOUNTS_SMS_RATE
+    caps the messages per second of each process.
+
+    """
+    backend = getattr(settings, 'ACCOUNTS_SMS_BACKEND',
+        'panomena_accounts.sms.ConsoleBackend')
+    rate = getattr(settings, 'ACCOUNTS_SMS_RATE', None)
+    return SMSDispatcher(class_from_string(backend)(), rate,
+        queue_size=getattr(settings, 'ACCOUNTS_SMS_QUEUE_SIZE', 1000),
+        retries=getattr(settings, 'ACCOUNTS_SMS_RETRIES', 3),
+    )
+
+
+def get_dispatcher():
+    """Returns the dispatcher for the configured backend."""
+    return registry.resolve('ACCOUNTS_SMS_BACKEND', load_dispatcher)
+
+
+def send_sms(recipient, body):
+    """Queues an SMS for sending."""
+    with phase('sms'):
+        get_dispatcher().enqueue(SMSMessage(recipient, body))
@@ -0,0 +1,339 @@
+import shutil
+import tempfile
+
+from django.db import models, connection, router
+from django.conf import settings
+from django.utils import unittest
+from django.test import TestCase, Client, RequestFactory
+from django.test.utils import override_settings
+from django.template import Template
+from django.contrib.auth import hashers
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.core.urlresolvers import reverse
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from panomena_accounts import identity, profile_cache, rendering, sms, \
+    routers, outbox, orphans
+from panomena_accounts.tokens import issue_reset_token, get_reset_token
+from panomena_accounts.models import OrphanedFile, MsisdnModelField, \
+    normalize_msisdn
+from panomena_accounts.forms import BaseProfileForm, USER_FIELDS, \
+    PASSWORD_FIELD
+
+
+class TestProfile(models.Model):
+    """Profile model used by the tests."""
+
+    user = models.OneToOneField(User)
+    image = models.FileField(upload_to='avatars', blank=True)
+    mobile_number = MsisdnModelField(max_length=32, blank=True, null=True,
+        unique=True)
+
+
+class TestRegisterForm(BaseProfileForm):
+    username = USER_FIELDS['username']()
+    email = USER_FIELDS['email']()
+    password = PASSWORD_FIELD()
+    confirm_password = PASSWORD_FIELD()
+
+
+class TestProfileForm(BaseProfileForm):
+    username = USER_FIELDS['username']()
+    email = USER_FIELDS['email']()
+
+
+class CountingHasher(hashers.MD5PasswordHasher):
+    """Hasher counting its key derivation runs. Verifying a password
+    encodes it once as well.
+
+    """
+
+    algorithm = 'counting_md5'
+    runs = 0
+
+    def encode(self, password, salt):
+        CountingHasher.runs += 1
+        return super(CountingHasher, self).encode(password, salt)
+
+
+TEMPLATES = (
+    'accounts/login.html',
+    'accounts/register.html',
+    'accounts/profile.html',
+    'accounts/avatar.html',
+)
+
+
+@override_settings(
+    AUTH_PROFILE_MODULE='panomena_accounts.TestProfile',
+    ACCOUNTS_REGISTER_FORM='panomena_accounts.tests.TestRegisterForm',
+    ACCOUNTS_PROFILE_FORM='panomena_accounts.tests.TestProfileForm',
+    ACCOUNTS_LOGIN_FORM='panomena_accounts.forms.LoginForm',
+    ACCOUNTS_LOGIN_TEST_COOKIE=False,
+    AUTHENTICATION_BACKENDS=(
+        'panomena_accounts.backends.ExecutorModelBackend',
+    ),
+    MIDDLEWARE_CLASSES=(
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+        'panomena_accounts.middleware.ProfileMiddleware',
+    ),
+    SESSION_ENGINE='django.contrib.sessions.backends.cache',
+    TEMPLATE_CONTEXT_PROCESSORS=(),
+)
+class AccountsTestCase(TestCase):
+    """Base test case with a user and stand-in templates."""
+
+    urls = 'panomena_accounts.urls'
+
+    def setUp(self):
+        self.hashers = (hashers.HASHERS, hashers.PREFERRED_HASHER)
+        hashers.load_hashers(['panomena_accounts.tests.CountingHasher'])
+        self.user = User(username='tester', email='tester@example.com')
+        self.user.set_password('secret')
+        self.user.save()
+        TestProfile.objects.create(user=self.user)
+        for name in TEMPLATES:
+            rendering.templates[name] = Template('{{ form }}')
+        CountingHasher.runs = 0
+
+    def tearDown(self):
+        rendering.templates.clear()
+        hashers.HASHERS, hashers.PREFERRED_HASHER = self.hashers
+
+
+class HashingTest(AccountsTestCase):
+    """Checks that each flow runs the password hasher once."""
+
+    def test_login(self):
+        response = self.client.post(reverse('accounts_login'), {
+            'username': 'tester',
+            'password': 'secret',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(CountingHasher.runs, 1)
+
+    def test_register(self):
+        response = self.client.post(reverse('accounts_register'), {
+            'username': 'newcomer',
+            'email': 'newcomer@example.com',
+            'password': 'secret',
+            'confirm_password': 'secret',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(CountingHasher.runs, 1)
+
+
+class QueryCountTest(AccountsTestCase):
+    """Pins the number of queries of the views for logged in users. The
+    user and profile are loaded together in one query.
+
+    """
+
+    def setUp(self):
+        super(QueryCountTest, self).setUp()
+        self.media_root = tempfile.mkdtemp()
+        # keep uploads out of the project's media root
+        self.image_field = TestProfile._meta.get_field('image')
+        self.storage = self.image_field.storage
+        self.image_field.storage = FileSystemStorage(location=self.media_root)
+        self.client.login(username='tester', password='secret')
+
+    def tearDown(self):
+        self.image_field.storage = self.storage
+        shutil.rmtree(self.media_root)
+        super(QueryCountTest, self).tearDown()
+
+    def test_profile_get(self):
+        # user with profile
+        with self.assertNumQueries(1):
+            self.client.get(reverse('accounts_profile'))
+
+    def test_profile_post(self):
+        # user with profile, username check, user update
+        with self.assertNumQueries(3):
+            self.client.post(reverse('accounts_profile'), {
+                'username': 'tester',
+                'email': 'changed@example.com',
+            })
+        self.assertEqual(
+            User.objects.get(pk=self.user.pk).email, 'changed@example.com'
+        )
+
+    def test_avatar_get(self):
+        # user with profile
+        with self.assertNumQueries(1):
+            self.client.get(reverse('accounts_avatar'))
+
+    def test_avatar_post(self):
+        upload = SimpleUploadedFile('avatar.png', 'not really an image')
+        # user with profile, image update
+        with self.assertNumQueries(2):
+            self.client.post(reverse('accounts_avatar'), {'avatar': upload})
+
+    def test_avatar_clear(self):
+        TestProfile.objects.filter(user=self.user).update(
+            image='avatars/old.png'
+        )
+        # creating the orphan record runs in a savepoint where supported
+        savepoints = 2 if connection.features.uses_savepoints else 0
+        # user with profile, image update, orphan lookup and insert
+        with self.assertNumQueries(4 + savepoints):
+            self.client.get(reverse('accounts_avatar_clear'))
+        self.assertTrue(
+            OrphanedFile.objects.filter(name='avatars/old.png').exists()
+        )
+
+
+@override_settings(ACCOUNTS_IDENTITY_CACHE='default')
+class IdentityTest(AccountsTestCase):
+    """Checks users restored from the identity cache."""
+
+    def test_password_loads_lazily(self):
+        identity.populate(self.user)
+        user = identity.recall(self.user.pk)
+        self.assertTrue(user.check_password('secret'))
+
+    def test_save_keeps_password(self):
+        identity.populate(self.user)
+        user = identity.recall(self.user.pk)
+        user.first_name = 'Changed'
+        user.save()
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(user.first_name, 'Changed')
+        self.assertTrue(user.check_password('secret'))
+
+    def test_profile_save_retires_snapshot(self):
+        identity.populate(self.user)
+        TestProfile.objects.get(user=self.user).save()
+        self.assertEqual(identity.recall(self.user.pk), None)
+
+
+@override_settings(MIDDLEWARE_CLASSES=(
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'panomena_accounts.middleware.ProfileMiddleware',
+))
+class ProfileDisplayTest(AccountsTestCase):
+    """Checks the caching of profile pages viewed anonymously."""
+
+    def setUp(self):
+        super(ProfileDisplayTest, self).setUp()
+        # start from a fresh version, keys may repeat between tests
+        profile_cache.invalidate_profile(self.user.pk)
+        self.url = reverse('accounts_profile', kwargs={'pk': self.user.pk})
+
+    def use_template(self, source):
+        rendering.templates['accounts/profile_display.html'] = \
+            Template(source)
+
+    def test_not_modified(self):
+        self.use_template('{{ user.username }}')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.url,
+            HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_cached_page(self):
+        self.use_template('{{ user.username }}')
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = Client().get(self.url)
+        self.assertEqual(response.content, 'tester')
+
+    def test_csrf_token_not_shared(self):
+        self.use_template('{% csrf_token %}{{ user.username }}')
+        first = Client().get(self.url)
+        second = Client().get(self.url)
+        self.assertNotEqual(first.content, second.content)
+        self.assertIn('csrftoken', second.cookies)
+
+
+@override_settings(ACCOUNTS_SMS_BACKEND='panomena_accounts.sms.LocmemBackend')
+class ForgotSMSTest(AccountsTestCase):
+    """Sends reset messages to numbers stored as typed by the user."""
+
+    typed = '082 555 1234'
+
+    def setUp(self):
+        super(ForgotSMSTest, self).setUp()
+        profile = TestProfile.objects.get(user=self.user)
+        profile.mobile_number = self.typed
+        profile.save()
+        rendering.templates['accounts/forgot_sms.html'] = \
+            Template('{{ form.errors }}')
+        rendering.templates['accounts/forgot_sms.txt'] = \
+            Template('Reset your password at {{ url }}')
+        del sms.outbox[:]
+
+    def test_number_is_normalized(self):
+        profile = TestProfile.objects.get(user=self.user)
+        self.assertEqual(profile.mobile_number, normalize_msisdn(self.typed))
+
+    def test_forgot_sms(self):
+        response = self.client.post(reverse('accounts_forgot_sms'), {
+            'mobile_number': self.typed,
+        })
+        self.assertEqual(response.status_code, 200)
+        sms.get_dispatcher().flush()
+        self.assertEqual(len(sms.outbox), 1)
+        message = sms.outbox[0]
+        self.assertEqual(message.recipient, normalize_msisdn(self.typed))
+        self.assertIn('/reset/', message.body)
+
+
+class RoutingTest(AccountsTestCase):
+    """Checks where account reads go with ACCOUNTS_READ_DATABASES set."""
+
+    multi_db = True
+
+    def setUp(self):
+        super(RoutingTest, self).setUp()
+        self.routers = router.routers
+        router.routers = [routers.AccountsRouter()]
+        routers.local.pinned = False
+
+    def tearDown(self):
+        router.routers = self.routers
+        routers.local.pinned = False
+        super(RoutingTest, self).tearDown()
+
+    @override_settings(ACCOUNTS_READ_DATABASES=('replica',))
+    def test_pinned_after_write(self):
+        account_router = routers.AccountsRouter()
+        self.assertEqual(account_router.db_for_read(User), 'replica')
+        self.user.save()
+        self.assertEqual(account_router.db_for_read(User), 'default')
+
+    @override_settings(ACCOUNTS_READ_DATABASES=('replica',))
+    def test_pin_cookie(self):
+        middleware = routers.ReplicaPinningMiddleware()
+        request = RequestFactory().post('/')
+        middleware.process_request(request)
+        routers.pin_to_primary()
+        response = middleware.process_response(request, HttpResponse())
+        request = RequestFactory().get('/')
+        request.COOKIES[routers.PIN_COOKIE] = \
+            response.cookies[routers.PIN_COOKIE].value
+        middleware.process_request(request)
+        self.assertTrue(routers.is_pinned())
+
+    @override_settings(ACCOUNTS_READ_DATABASES=('missing',))
+    def test_workers_read_primary(self):
+        # reads routed to the unconfigured replica would fail
+        self.assertFalse(orphans.is_referenced('avatars/missing.png'))
+        self.assertEqual(orphans.claim(10), [])
+        self.assertEqual(outbox.claim(10), [])
+
+    @unittest.skipUnless('replica' in settings.DATABASES,
+        "needs a separate 'replica' database, such as a second sqlite file")
+    @override_settings(ACCOUNTS_READ_DATABASES=('replica',))
+    def test_reset_token_retried_on_primary(self):
+        raw_token = issue_reset_token(self.user)
+        # the token only exists on the primary
+        routers.local.pinned = False
+        self.assertNotEqual(get_reset_token(raw_token), None)
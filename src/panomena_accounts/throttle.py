@@ -0,0 +1,153 @@
+import time
+import hashlib
+import threading
+from functools import wraps
+from collections import OrderedDict
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.core.cache import get_cache
+from django.utils.decorators import available_attrs
+from django.utils.encoding import smart_str
+from django.utils.translation import ugettext as _
+
+from panomena_accounts.utils import registry
+
+
+class LocalBuckets(object):
+    """In-process token buckets keyed by client. Each tracked key holds a
+    constant amount of state and the least recently used keys are evicted
+    once the limit is reached.
+
+    """
+
+    def __init__(self, rate, period, max_keys=10000):
+        self.capacity = float(rate)
+        self.refill = rate / float(period)
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def allow(self, key, now):
+        """Takes a token from the bucket of the key if one is available."""
+        with self.lock:
+            tokens, stamp = self.buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - stamp) * self.refill)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+            # evict the least recently seen keys
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return allowed
+
+
+class SharedWindows(object):
+    """Sliding windows kept in a shared cache so limits hold across nodes.
+    The window is approximated from the counters of the current and the
+    previous fixed period.
+
+    """
+
+    def __init__(self, rate, period, cache_alias='default'):
+        self.rate = rate
+        self.period = period
+        self.cache = get_cache(cache_alias)
+
+    def counter_key(self, key, window):
+        """Returns the cache key of the counter for a window."""
+        return 'accounts:throttle:%s:%d' % (key, window)
+
+    def allow(self, key, now):
+        """Counts the attempt if the sliding window has room for it."""
+        window = int(now // self.period)
+        current = self.counter_key(key, window)
+        previous = self.counter_key(key, window - 1)
+        counts = self.cache.get_many([current, previous])
+        # weigh the previous window by its overlap with the sliding one
+        overlap = 1 - (now % self.period) / float(self.period)
+        estimate = counts.get(previous, 0) * overlap + counts.get(current, 0)
+        if estimate >= self.rate:
+            return False
+        self.cache.add(current, 0, self.period * 2)
+        try:
+            self.cache.incr(current)
+        except ValueError:
+            self.cache.set(current, 1, self.period * 2)
+        return True
+
+
+class Throttle(object):
+    """Per client and per username limits for a view, checked against the
+    local tier first and the optional shared tier second.
+
+    """
+
+    def __init__(self, name, config):
+        self.name = name
+        self.tiers = {}
+        for scope in ('IP', 'USERNAME'):
+            if scope not in config:
+                continue
+            rate, period = config[scope]
+            tiers = [LocalBuckets(rate, period, config.get('MAX_KEYS', 10000))]
+            if config.get('CACHE'):
+                tiers.append(SharedWindows(rate, period, config['CACHE']))
+            self.tiers[scope] = tiers
+
+    def client_keys(self, request, username_field):
+        """Returns the throttled keys of the request per scope."""
+        keys = {'IP': request.META.get('REMOTE_ADDR', '')}
+        username = request.POST.get(username_field, '')
+        if username:
+            keys['USERNAME'] = username.strip().lower()
+        return keys
+
+    def allow(self, request, username_field='username'):
+        """Returns whether the request is within all configured limits."""
+        now = time.time()
+        keys = self.client_keys(request, username_field)
+        for scope, tiers in self.tiers.items():
+            if scope not in keys:
+                continue
+            digest = hashlib.md5(smart_str(keys[scope])).hexdigest()
+            key = '%s:%s:%s' % (self.name, scope.lower(), digest)
+            for tier in tiers:
+                if not tier.allow(key, now):
+                    return False
+        return True
+
+
+def load_throttles():
+    """Builds the throttles configured in ACCOUNTS_THROTTLES."""
+    config = getattr(settings, 'ACCOUNTS_THROTTLES', {})
+    return dict(
+        (name, Throttle(name, limits)) for name, limits in config.items()
+    )
+
+
+def get_throttle(name):
+    """Returns the throttle configured for the view name or None."""
+    throttles = registry.resolve('ACCOUNTS_THROTTLES', load_throttles)
+    return throttles.get(name, None)
+
+
+def throttled(name, username_field='username'):
+    """Decorator rejecting POST requests over the limits configured for
+    the view name before the view does any work.
+
+    """
+    def decorator(view):
+        @wraps(view, assigned=available_attrs(view))
+        def wrapper(request, *args, **kwargs):
+            throttle = get_throttle(name)
+            if request.method == 'POST' and throttle is not None:
+                if not throttle.allow(request, username_field):
+                    return HttpResponse(
+                        _('Too many attempts, please try again later.'),
+                        status=429,
+                    )
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,92 @@
+import uuid
+import time
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.encoding import smart_str
+
+from panomena_accounts.models import PasswordResetToken
+from panomena_accounts.routers import is_pinned, primary_database, \
+    replica_databases
+
+
+def hash_token(raw_token):
+    """Returns the stored representation of a raw token."""
+    return hashlib.sha256(smart_str(raw_token)).hexdigest()
+
+
+def token_expiry():
+    """Returns the expiry time for a token issued now."""
+    seconds = getattr(settings, 'ACCOUNTS_RESET_TOKEN_EXPIRY', 2 * 24 * 3600)
+    return timezone.now() + timedelta(seconds=seconds)
+
+
+def build_reset_token(user, expires=None):
+    """Returns a new raw token and the unsaved token record for the user,
+    for issuing tokens in bulk.
+
+    """
+    raw_token = uuid.uuid4().hex
+    token = PasswordResetToken(
+        user=user,
+        token_hash=hash_token(raw_token),
+        expires=expires or token_expiry(),
+    )
+    return raw_token, token
+
+
+def issue_reset_token(user):
+    """Issues a new reset token for the user and returns the raw token,
+    which is never stored.
+
+    """
+    raw_token, token = build_reset_token(user)
+    token.save()
+    return raw_token
+
+
+def get_reset_token(raw_token):
+    """Returns the unexpired token matching the raw token or None. Misses
+    on a replica are retried on the primary, since reset links are often
+    followed before a fresh token has replicated.
+
+    """
+    tokens = PasswordResetToken.objects.select_related('user')
+    lookup = {
+        'token_hash': hash_token(raw_token),
+        'expires__gt': timezone.now(),
+    }
+    try:
+        return tokens.get(**lookup)
+    except PasswordResetToken.DoesNotExist:
+        pass
+    if is_pinned() or not replica_databases():
+        return None
+    try:
+        return tokens.using(primary_database()).get(**lookup)
+    except PasswordResetToken.DoesNotExist:
+        return None
+
+
+def revoke_reset_tokens(user):
+    """Removes all outstanding reset tokens of the user."""
+    PasswordResetToken.objects.filter(user=user).delete()
+
+
+def purge_expired_tokens(chunk_size=1000, pause=0):
+    """Deletes expired tokens in chunks of bounded size, yielding the
+    number of tokens deleted per chunk.
+
+    """
+    now = timezone.now()
+    expired = PasswordResetToken.objects.filter(expires__lte=now)
+    while True:
+        pks = list(expired.values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            break
+        PasswordResetToken.objects.filter(pk__in=pks).delete()
+        yield len(pks)
+        if pause:
+            time.sleep(pause)
@@ -4,6 +4,7 @@ from django.conf.urls.defaults import *
 urlpatterns = patterns('panomena_accounts.views',
     url(r'^register/$', 'register', {}, 'accounts_register'),
     url(r'^profile/$', 'profile', {}, 'accounts_profile'),
+    url(r'^profile/api/$', 'profile_api', {}, 'accounts_profile_api'),
     url(r'^profile/(?P<pk>\d+)/$', 'profile_display', {}, 'accounts_profile'),
     url(
         r'^login/$', 'login',
@@ -26,6 +27,11 @@ urlpatterns = patterns('panomena_accounts.views',
         'accounts_forgot_form'
     ),
     url(r'^reset/(?P<reset_uuid>[\w\-\+_]+)/$', 'reset', {}, 'accounts_reset'),
+    url(
+        r'^username/check/$', 'username_check', {},
+        'accounts_username_check'
+    ),
+    url(r'^export/$', 'export', {}, 'accounts_export'),
     url(r'^logout/$', 'logout', {}, 'accounts_logout'),
     url(r'^forgot/sms/$', 'forgot_sms', {}, 'accounts_forgot_sms'),
     url(r'^avatar/$', 'avatar', {}, 'accounts_avatar'),
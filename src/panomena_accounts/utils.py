@@ -1,10 +1,80 @@
+import threading
+
 from django.db import models
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.contrib.auth.models import SiteProfileNotAvailable
+from django.test.signals import setting_changed
 
+from panomena_general.utils import class_from_string, SettingsFetcher
 
-def get_profile_model():
+from panomena_accounts.instrumentation import phase
+
+
+accounts_settings = SettingsFetcher('accounts')
+
+
+class ResolverRegistry(object):
+    """Resolves settings driven objects once per process and keeps them
+    until the setting they were resolved from changes.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.resolved = {}
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, key, loader):
+        """Returns the cached value for the key or calls the loader to
+        resolve and cache it.
+
+        """
+        try:
+            value = self.resolved[key]
+            self.hits += 1
+            return value
+        except KeyError:
+            pass
+        # resolve outside of the lock, loaders may be slow
+        value = loader()
+        with self.lock:
+            self.misses += 1
+            self.resolved[key] = value
+        return value
+
+    def invalidate(self, key=None):
+        """Drops the cached value for the key or all values if no key
+        is given.
+
+        """
+        with self.lock:
+            if key is None:
+                self.resolved.clear()
+            else:
+                self.resolved.pop(key, None)
+
+    def stats(self):
+        """Returns the hit and miss counters."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.resolved),
+        }
+
+
+registry = ResolverRegistry()
+
+
+def settings_changed_handler(sender, setting, **kwargs):
+    """Invalidates resolved values when their setting changes."""
+    registry.invalidate(setting)
+
+setting_changed.connect(settings_changed_handler)
+
+
+def load_profile_model():
     """Retrieves the profile model from AUTH_PROFILE_MODULE and raises the
     appropriate exceptions when something goes wrong.
 
@@ -28,3 +98,39 @@ def get_profile_model():
     except (ImportError, ImproperlyConfigured):
         raise SiteProfileNotAvailable
     return model
+
+
+def get_profile_model():
+    """Returns the profile model, resolving it only once per process."""
+    return registry.resolve('AUTH_PROFILE_MODULE', load_profile_model)
+
+
+def get_form_class(setting):
+    """Returns the form class named by the given accounts setting,
+    resolving it only once per process.
+
+    """
+    loader = lambda: class_from_string(getattr(accounts_settings, setting))
+    return registry.resolve(setting, loader)
+
+
+def get_profile(user):
+    """Returns the profile of the user, memoized on the user object for
+    the rest of the request. Raises the profile model's DoesNotExist if
+    the user has no profile.
+
+    """
+    try:
+        return user._profile_cache
+    except AttributeError:
+        pass
+    profile_model = get_profile_model()
+    # unsaved users cannot have a profile yet
+    if user.pk is None:
+        raise profile_model.DoesNotExist
+    profiles = profile_model._default_manager.using(user._state.db)
+    with phase('profile'):
+        profile = profiles.get(user__id__exact=user.id)
+    profile.user = user
+    user._profile_cache = profile
+    return profile
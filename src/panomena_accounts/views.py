@@ -1,17 +1,35 @@
-from django.template import RequestContext
-from django.shortcuts import render_to_response, redirect, get_object_or_404
-from django.contrib.auth import authenticate, login as auth_login
+import json
+
+from django.conf import settings as django_settings
+from django.http import HttpResponse, HttpResponseBadRequest, \
+    HttpResponseNotAllowed, StreamingHttpResponse
+from django.core.exceptions import ValidationError
+from django.shortcuts import redirect, get_object_or_404
+from django.contrib.auth import authenticate, get_backends, \
+    login as auth_login
 from django.contrib.auth.views import logout as auth_logout
 from django.contrib.auth.models import User
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, \
+    user_passes_test
+from django.views.decorators.http import condition
+from django.utils.cache import patch_cache_control
 
-from panomena_general.utils import class_from_string, SettingsFetcher, \
-    ajax_redirect
+from panomena_general.utils import SettingsFetcher, ajax_redirect
 
 from panomena_accounts.forms import AvatarForm, ForgotForm, ResetForm, \
-    ForgotSMSForm
-from panomena_accounts.utils import get_profile_model
-from panomena_accounts.exceptions import PasswordResetFieldException
+    ForgotSMSForm, USER_FIELDS
+from panomena_accounts import api, availability, identity, \
+    profile_cache, signals
+from panomena_accounts.utils import get_profile_model, get_profile, \
+    get_form_class
+from panomena_accounts.export import FORMATS, export_lines
+from panomena_accounts.hashing import set_password
+from panomena_accounts.instrumentation import instrumented
+from panomena_accounts.orphans import clear_avatar
+from panomena_accounts.rendering import render, render_content, \
+    build_context
+from panomena_accounts.throttle import throttled
+from panomena_accounts.tokens import get_reset_token, revoke_reset_tokens
 
 
 settings = SettingsFetcher('accounts')
@@ -20,33 +38,36 @@ settings = SettingsFetcher('accounts')
 class RegisterView(object):
     """Account registration view."""
 
-    def authenticate(self, data):
-        """Authenticate and return the user."""
-        user = authenticate(
-            username=data['username'],
-            password=data['password']
+    def authenticate(self, user):
+        """Attach the first authentication backend to the saved user so it
+        can be logged in without hashing the password again.
+
+        """
+        backend = get_backends()[0]
+        user.backend = '%s.%s' % (
+            backend.__module__,
+            backend.__class__.__name__,
         )
         return user
 
     def valid(self, request, form):
         """Process a valid form."""
-        form.save()
-        # authenticate and login user
-        data = form.cleaned_data
-        user = self.authenticate(data)
+        user = form.save()
+        # login the freshly saved user
+        user = self.authenticate(user)
         auth_login(request, user)
+        identity.populate(user)
         # redirect appropriately
         url = settings.LOGIN_REDIRECT_URL
         return ajax_redirect(request, url)
 
     def form(self):
         """Returns the form to be used."""
-        return class_from_string(settings.ACCOUNTS_REGISTER_FORM)
+        return get_form_class('ACCOUNTS_REGISTER_FORM')
 
     def __call__(self, request):
         """Basic form view mechanics."""
         register_form = self.form()
-        context = RequestContext(request)
         # handle the form
         if request.method == 'POST':
             form = register_form(request, request.POST)
@@ -54,41 +75,114 @@ class RegisterView(object):
                 return self.valid(request, form)
         else:
             form = register_form(request)
-        context = RequestContext(request, {
+        return render(request, 'accounts/register.html', {
             'title': 'Register',
             'form': form,
         })
-        return render_to_response('accounts/register.html', context)
 
-register = RegisterView()
+register = instrumented('register')(RegisterView())
 
 
 @login_required
+@instrumented('profile')
 def profile(request, id=None):
     """Account profile edit view for a current user profile."""
     # get the the requested profile if id specified
-    profile_form = settings.ACCOUNTS_PROFILE_FORM
-    profile_form = class_from_string(profile_form)
+    profile_form = get_form_class('ACCOUNTS_PROFILE_FORM')
     user = request.user
-    context = RequestContext(request)
     if request.method == 'POST':
         form = profile_form(request, request.POST, user=user)
         if form.is_valid():
             form.save()
     else:
         form = profile_form(request, user=user)
-    context = RequestContext(request, {
+    return render(request, 'accounts/profile.html', {
         'title': 'Profile',
         'form': form,
     })
-    return render_to_response('accounts/profile.html', context)
 
 
+def json_response(content, status=200, etag=None):
+    """Returns the content as a compact JSON response."""
+    response = HttpResponse(api.encode(content), status=status,
+        content_type='application/json')
+    if etag is not None:
+        response['ETag'] = etag
+    return response
+
+
+@login_required
+@instrumented('profile_api')
+def profile_api(request):
+    """JSON profile view for the current user. GET returns the profile
+    values, POST or PATCH apply a JSON object of changed values only.
+    Updates are rejected if an If-Match header does not match the
+    current entity tag.
+
+    """
+    profile_form = get_form_class('ACCOUNTS_PROFILE_FORM')
+    user = request.user
+    form = profile_form(request, user=user)
+    values = api.profile_values(form)
+    etag = api.values_etag(values)
+    if request.method == 'GET':
+        return json_response(values, etag=etag)
+    if request.method not in ('POST', 'PATCH'):
+        return HttpResponseNotAllowed(['GET', 'POST', 'PATCH'])
+    # check for concurrent modification
+    if_match = request.META.get('HTTP_IF_MATCH', None)
+    if if_match is not None and if_match not in ('*', etag):
+        return json_response({'errors': {'__all__': ['Profile changed.']}},
+            status=412, etag=etag)
+    # parse and check the submitted changes
+    try:
+        changes = json.loads(request.body)
+    except ValueError:
+        changes = None
+    if not isinstance(changes, dict):
+        return json_response({'errors': {'__all__': ['Invalid JSON.']}},
+            status=400)
+    unknown = sorted(set(changes) - set(values))
+    if unknown:
+        return json_response({'errors': dict(
+            (name, ['Unknown field.']) for name in unknown
+        )}, status=400)
+    # validate the changes with the profile form and save them
+    data = api.merged_data(values, changes)
+    form = profile_form(request, data, user=user)
+    if not form.is_valid():
+        return json_response({'errors': dict(
+            (name, [unicode(error) for error in errors])
+            for name, errors in form.errors.items()
+        )}, status=400)
+    form.save(fields=changes.keys())
+    values = api.profile_values(profile_form(request, user=user))
+    return json_response(values, etag=api.values_etag(values))
+
+
+def render_profile_display(request, pk):
+    """Renders the profile display page for the user account."""
+    context = build_context(request, {
+        'user': get_object_or_404(User, pk=pk),
+    })
+    return render_content('accounts/profile_display.html', context)
+
+
+@condition(
+    etag_func=profile_cache.page_etag,
+    last_modified_func=profile_cache.page_last_modified,
+)
 def profile_display(request, pk):
-    """Account profile display for user accounts."""
-    context = RequestContext(request)
-    context['user'] = get_object_or_404(User, pk=pk)
-    return render_to_response('accounts/profile_display.html', context)
+    """Account profile display for user accounts. Pages viewed
+    anonymously are served from the profile cache.
+
+    """
+    if request.user.is_authenticated():
+        content = render_profile_display(request, pk)
+    else:
+        build = lambda: render_profile_display(request, pk)
+        content = profile_cache.cached_page(request, pk, build)
+    return HttpResponse(content)
 
 
 class LoginView(object):
@@ -96,14 +190,17 @@ class LoginView(object):
 
     def valid(self, request, form):
         """Process a valid form."""
-        # authenticate and login user
         data = form.cleaned_data
-        # todo: if form is based on django auth form then this step can be removed
-        user = authenticate(
-            username=data['username'],
-            password=data['password'],
-        )
+        # reuse the user authenticated during validation
+        if hasattr(form, 'get_user'):
+            user = form.get_user()
+        else:
+            user = authenticate(
+                username=data['username'],
+                password=data['password'],
+            )
         auth_login(request, user)
+        identity.populate(user)
         # redirect to next url if available
         # todo: check that form is base on LoginForm
         next_url = data.get('next', '')
@@ -113,9 +210,9 @@ class LoginView(object):
         url = settings.LOGIN_REDIRECT_URL
         return ajax_redirect(request, url)
 
-    def __call__(self, request, template='accounts/login.html'):
-        login_form = settings.ACCOUNTS_LOGIN_FORM
-        login_form = class_from_string(login_form)
+    def __call__(self, request, template='accounts/login.html',
+            fragment=False):
+        login_form = get_form_class('ACCOUNTS_LOGIN_FORM')
         if request.method == 'POST':
             form = login_form(request, request.POST)
             if form.is_valid():
@@ -123,19 +220,42 @@ class LoginView(object):
         else:
             form = login_form(request)
             # todo: check for session middleware
-            request.session.set_test_cookie()
+            if self.test_cookie():
+                request.session.set_test_cookie()
         # build context and render template
-        context = RequestContext(request, {
+        response = render(request, template, {
             'title': 'Login',
             'form': form,
             'next': request.GET.get('next', None),
-        })
-        return render_to_response(template, context)
+        }, fragment)
+        if request.method == 'GET':
+            self.cache_anonymous(request, response)
+        return response
+
+    def test_cookie(self):
+        """Returns whether login pages set the session test cookie."""
+        return getattr(django_settings, 'ACCOUNTS_LOGIN_TEST_COOKIE', True)
+
+    def cache_anonymous(self, request, response):
+        """Lets shared caches store login pages served to anonymous
+        visitors when no test cookie is set. Pages rendering a csrf token
+        are personal and never shared, so the login template must fetch
+        its token separately for this to take effect.
+
+        """
+        timeout = getattr(django_settings, 'ACCOUNTS_LOGIN_CACHE_TIMEOUT', 0)
+        if not timeout or self.test_cookie():
+            return
+        if request.META.get('CSRF_COOKIE_USED'):
+            return
+        if not request.user.is_authenticated():
+            patch_cache_control(response, public=True, max_age=timeout)
 
-login = LoginView()
+login = throttled('login')(instrumented('login')(LoginView()))
 
 
 @login_required
+@instrumented('avatar')
 def avatar(request):
     """Displays and updates the users avatar."""
     user = request.user
@@ -145,11 +265,10 @@ def avatar(request):
             form.save()
     else:
         form = AvatarForm(user)
-    context = RequestContext(request, {
+    return render(request, 'accounts/avatar.html', {
         'title': 'Avatar',
         'form': form,
     })
-    return render_to_response('accounts/avatar.html', context)
 
 
 @login_required
@@ -157,52 +276,83 @@ def avatar_clear(request):
     """Clears the avatar of a user."""
     profile_model = get_profile_model()
     try:
-        profile = request.user.get_profile()
-        profile.image.delete()
+        profile = get_profile(request.user)
+        clear_avatar(profile)
     except profile_model.DoesNotExist:
         pass
+    else:
+        signals.profile_changed.send(sender=None, user=request.user)
     return redirect('accounts_avatar')
 
 
-def forgot(request, template):
+@throttled('forgot')
+@instrumented('forgot')
+def forgot(request, template, fragment=False):
     """View for retrieving a forgotten password."""
     form = ForgotForm(request)
-    context = RequestContext(request, {'form': form})
-    return render_to_response(template, context)
+    return render(request, template, {'form': form}, fragment)
 
 
+@instrumented('reset')
 def reset(request, reset_uuid):
     """View for resetting a user password."""
-    profile_model = get_profile_model()
-    profile = None
-    # validate the provided uuid
-    try:
-        profile = profile_model.objects.get(password_reset=reset_uuid)
-        # check if the profile model has the password reset field
-        if not hasattr(profile, 'password_reset'):
-            raise PasswordResetFieldException()
-        authenticated = True
-    except profile_model.DoesNotExist:
-        authenticated = False
+    # validate the provided token
+    token = get_reset_token(reset_uuid)
+    authenticated = token is not None
     # handle the form
-    if request.method == 'POST' and profile:
+    if request.method == 'POST' and token:
         form = ResetForm(request.POST)
         if form.is_valid():
             data = form.cleaned_data
             # set the user's password
-            profile.user.set_password(data['password'])
-            profile.user.save()
-            # nullify the reset identifier to disable the old link
-            profile.password_reset = None
-            profile.save()
+            user = token.user
+            set_password(user, data['password'])
+            user.save()
+            # revoke the user's tokens to disable the old links
+            revoke_reset_tokens(user)
     else:
         form = ResetForm()
     # build context and render
-    context = RequestContext(request, {
+    return render(request, 'accounts/reset.html', {
         'form': form,
         'authenticated': authenticated,
     })
-    return render_to_response('accounts/reset.html', context)
+
+
+def username_check(request):
+    """Reports whether the requested username is available as JSON, for
+    checking availability while the registration form is filled in.
+
+    """
+    username = request.GET.get('username', '')
+    user = request.user if request.user.is_authenticated() else None
+    try:
+        username = USER_FIELDS['username']().clean(username)
+    except ValidationError as e:
+        result = {'available': False, 'errors': e.messages}
+    else:
+        available = availability.username_available(username, user,
+            authoritative=False)
+        result = {'available': available}
+    result['username'] = username
+    return HttpResponse(json.dumps(result), content_type='application/json')
+
+
+@user_passes_test(lambda user: user.is_staff)
+def export(request):
+    """Streams the accounts with their profiles to staff members."""
+    format = request.GET.get('format', 'csv')
+    names = [n for n in request.GET.get('fields', '').split(',') if n]
+    if format not in FORMATS:
+        return HttpResponseBadRequest('Unknown format.')
+    try:
+        content_type, lines = export_lines(format, names)
+    except ValueError as e:
+        return HttpResponseBadRequest(unicode(e))
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    response['Content-Disposition'] = \
+        'attachment; filename=accounts.%s' % format
+    return response
 
 
 def logout(request):
@@ -212,6 +362,8 @@ def logout(request):
     return response
 
 
+@throttled('forgot_sms', 'mobile_number')
+@instrumented('forgot_sms')
 def forgot_sms(request):
     """Allows the user to send forgotten password to registered
     mobile number.
@@ -221,8 +373,7 @@ def forgot_sms(request):
         form = ForgotSMSForm(request.POST)
         if form.is_valid():
             # send the sms to the user
-            pass
+            form.send(request)
     else:
         form = ForgotSMSForm()
-    context = RequestContext(request, {'form': form})
-    return render_to_response('accounts/forgot_sms.html', context)
+    return render(request, 'accounts/forgot_sms.html', {'form': form})